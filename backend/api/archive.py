@@ -0,0 +1,396 @@
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from itertools import islice
+from multiprocessing import get_context
+from pathlib import Path
+from uuid import uuid4
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+
+from .cache import (INGREDIENTS_VERSION, RECIPE_LIST_VERSION, TAGS_VERSION,
+                    bump_versions, count_version_name)
+from .catalog import INGREDIENTS, TAGS, upsert_batch
+from .counters import change_counters
+from .feed import fan_out_recipe
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Файл рецептов и каталог изображений в архиве
+RECIPES_FILE = 'recipes.jsonl'
+MEDIA_DIRECTORY = 'media'
+# Количество рецептов, читаемых или записываемых за один раз
+CHUNK_SIZE: int = 500
+# Размер части файла при копировании изображения
+COPY_CHUNK_SIZE: int = 64 * 1024
+# Поля автора, переносимые вместе с рецептом
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+def export_image(root, storage, name, exported):
+    """Скопировать изображение в архив под именем по хэшу содержимого.
+
+    Одинаковые изображения сохраняются в архиве один раз. exported —
+    уже выгруженные файлы {имя в хранилище: имя в архиве}.
+    """
+    if name in exported:
+        return exported[name]
+    digest = hashlib.sha256()
+    temporary = root / MEDIA_DIRECTORY / f'.{uuid4()}.part'
+    with storage.open(name, 'rb') as source, open(temporary, 'wb') as target:
+        for chunk in iter(partial(source.read, COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            target.write(chunk)
+    archive_name = (
+        f'{MEDIA_DIRECTORY}/{digest.hexdigest()}{Path(name).suffix.lower()}'
+    )
+    if (root / archive_name).exists():
+        temporary.unlink()
+    else:
+        os.replace(temporary, root / archive_name)
+    exported[name] = archive_name
+    return archive_name
+
+
+def serialize_recipes(root, recipes, exported):
+    """Строки JSONL для части рецептов.
+
+    Теги и ингредиенты выбираются двумя запросами на всю часть.
+    """
+    ids = [recipe.id for recipe in recipes]
+    tags, ingredients = {}, {}
+    for recipe_id, name, color, slug in Recipe.tags.through.objects.filter(
+        recipe_id__in=ids
+    ).values_list('recipe_id', 'tag__name', 'tag__color', 'tag__slug'):
+        tags.setdefault(recipe_id, []).append(
+            {'name': name, 'color': color, 'slug': slug}
+        )
+    for recipe_id, name, measurement_unit, amount in (
+        IngredientRecipe.objects.filter(recipe_id__in=ids).values_list(
+            'recipe_id',
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount'
+        )
+    ):
+        ingredients.setdefault(recipe_id, []).append({
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        })
+    for recipe in recipes:
+        image = None
+        if recipe.image:
+            try:
+                image = export_image(
+                    root, recipe.image.storage, recipe.image.name, exported
+                )
+            except OSError:
+                logger.warning(
+                    'Изображение рецепта %s не найдено: %s',
+                    recipe.id, recipe.image.name
+                )
+        yield json.dumps(
+            {
+                'author': {
+                    field: getattr(recipe.author, field)
+                    for field in AUTHOR_FIELDS
+                },
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'pub_date': recipe.pub_date.isoformat(),
+                'image': image,
+                'tags': tags.get(recipe.id, []),
+                'ingredients': ingredients.get(recipe.id, []),
+            },
+            ensure_ascii=False
+        ) + '\n'
+
+
+def export_recipes(root, chunk_size=CHUNK_SIZE):
+    """Выгрузить рецепты в каталог архива.
+
+    Рецепты читаются частями по id и записываются в JSONL потоком.
+    Возвращает число рецептов и число файлов изображений.
+    """
+    root = Path(root)
+    (root / MEDIA_DIRECTORY).mkdir(parents=True, exist_ok=True)
+    recipes = Recipe.objects.select_related('author').order_by('id')
+    exported = {}
+    count = 0
+    last_id = 0
+    with open(root / RECIPES_FILE, 'w', encoding='utf-8') as file:
+        while True:
+            chunk = list(recipes.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            file.writelines(serialize_recipes(root, chunk, exported))
+            count += len(chunk)
+    return count, len(set(exported.values()))
+
+
+def read_chunks(root, chunk_size):
+    """Записи архива частями по chunk_size."""
+    with open(Path(root) / RECIPES_FILE, encoding='utf-8') as file:
+        items = (json.loads(line) for line in file if line.strip())
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def resolve_authors(chunk, stats):
+    """Id авторов по email, отсутствующие авторы создаются."""
+    authors = {item['author']['email']: item['author'] for item in chunk}
+    author_ids = dict(
+        User.objects.filter(email__in=authors).values_list('email', 'id')
+    )
+    missing = [
+        User(
+            password=make_password(None),
+            **{field: author[field] for field in AUTHOR_FIELDS}
+        )
+        for email, author in authors.items() if email not in author_ids
+    ]
+    if missing:
+        User.objects.bulk_create(missing, ignore_conflicts=True)
+        author_ids = dict(
+            User.objects.filter(email__in=authors).values_list('email', 'id')
+        )
+        conflicts = authors.keys() - author_ids.keys()
+        if conflicts:
+            raise ValueError(
+                'Не удалось создать авторов, username или имя заняты: '
+                f'{", ".join(sorted(conflicts))}.'
+            )
+        stats['authors'] += len(missing)
+    return author_ids
+
+
+def resolve_references(chunk, stats):
+    """Подготовить часть архива к записи в рабочем процессе.
+
+    Авторы, теги и ингредиенты находятся или создаются в основном
+    процессе, поэтому рабочие процессы получают готовые id и не
+    создают одни и те же записи одновременно.
+    """
+    author_ids = resolve_authors(chunk, stats)
+    tags = {
+        (tag['slug'],): (tag['name'], tag['color'], tag['slug'])
+        for item in chunk for tag in item['tags']
+    }
+    ingredients = {
+        (ingredient['name'], ingredient['measurement_unit']): (
+            ingredient['name'], ingredient['measurement_unit']
+        )
+        for item in chunk for ingredient in item['ingredients']
+    }
+    if tags:
+        stats['tags'] += upsert_batch(TAGS, tags, update=False).inserted
+    if ingredients:
+        stats['ingredients'] += upsert_batch(
+            INGREDIENTS, ingredients
+        ).inserted
+    tag_ids = dict(
+        Tag.objects.filter(
+            slug__in=[slug for slug, in tags]
+        ).values_list('slug', 'id')
+    )
+    ingredient_ids = {
+        (name, measurement_unit): ingredient_id
+        for ingredient_id, name, measurement_unit
+        in Ingredient.objects.filter(
+            name__in={name for name, _ in ingredients}
+        ).values_list('id', 'name', 'measurement_unit')
+    }
+    return [
+        {
+            'author_id': author_ids[item['author']['email']],
+            'name': item['name'],
+            'text': item['text'],
+            'cooking_time': item['cooking_time'],
+            'pub_date': item['pub_date'],
+            'image': item['image'],
+            'tags': [tag_ids[tag['slug']] for tag in item['tags']],
+            'ingredients': [
+                (
+                    ingredient_ids[(
+                        ingredient['name'], ingredient['measurement_unit']
+                    )],
+                    ingredient['amount']
+                )
+                for ingredient in item['ingredients']
+            ],
+        }
+        for item in chunk
+    ]
+
+
+def store_image(root, archive_name):
+    """Скопировать изображение из архива в хранилище.
+
+    Имя файла в хранилище строится по хэшу содержимого, поэтому
+    одинаковые изображения хранятся один раз, а при повторном
+    импорте не копируются заново.
+    """
+    field = Recipe._meta.get_field('image')
+    name = field.generate_filename(None, Path(archive_name).name)
+    if field.storage.exists(name):
+        return name
+    with open(Path(root) / archive_name, 'rb') as source:
+        saved = field.storage.save(name, File(source))
+    if saved != name:
+        # Тот же файл успел сохранить другой рабочий процесс
+        field.storage.delete(saved)
+    return name
+
+
+def create_recipes(rows, images):
+    """Записать рецепты части архива с тегами и ингредиентами."""
+    recipes = [
+        Recipe(
+            author_id=row['author_id'],
+            name=row['name'],
+            text=row['text'],
+            cooking_time=row['cooking_time'],
+            image=images.get(row['image'], '')
+        )
+        for row in rows
+    ]
+    Recipe.objects.bulk_create(recipes)
+    if recipes[0].pk is None:
+        # Django 3.2 не получает id из bulk_create в SQLite. Блокировка
+        # записи держится до конца транзакции, поэтому последние id
+        # принадлежат только что добавленным рецептам.
+        ids = list(
+            Recipe.objects.order_by('-id').values_list(
+                'id', flat=True
+            )[:len(recipes)]
+        )
+        for recipe, recipe_id in zip(recipes, reversed(ids)):
+            recipe.id = recipe_id
+    # auto_now_add заменяет дату публикации при вставке
+    for recipe, row in zip(recipes, rows):
+        recipe.pub_date = row['pub_date']
+    Recipe.objects.bulk_update(recipes, ('pub_date',))
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+        for recipe, row in zip(recipes, rows)
+        for tag_id in set(row['tags'])
+    )
+    IngredientRecipe.objects.bulk_create(
+        IngredientRecipe(
+            recipe_id=recipe.id, ingredient_id=ingredient_id, amount=amount
+        )
+        for recipe, row in zip(recipes, rows)
+        for ingredient_id, amount in dict(row['ingredients']).items()
+    )
+    return recipes
+
+
+def import_chunk(root, rows):
+    """Записать часть архива, пропуская уже загруженные рецепты.
+
+    Рецепт считается загруженным, если у автора есть рецепт с тем же
+    названием и датой публикации, поэтому прерванный импорт можно
+    запустить повторно. Выполняется в рабочем процессе. Возвращает
+    число добавленных и пропущенных рецептов.
+    """
+    for row in rows:
+        row['pub_date'] = parse_datetime(row['pub_date'])
+    existing = set(
+        Recipe.objects.filter(
+            author_id__in={row['author_id'] for row in rows},
+            name__in={row['name'] for row in rows}
+        ).values_list('author_id', 'name', 'pub_date')
+    )
+    pending = {}
+    for row in rows:
+        key = (row['author_id'], row['name'], row['pub_date'])
+        if key not in existing:
+            pending.setdefault(key, row)
+    if not pending:
+        return 0, len(rows)
+    images = {
+        archive_name: store_image(root, archive_name)
+        for archive_name in {row['image'] for row in pending.values()}
+        if archive_name
+    }
+    with transaction.atomic():
+        recipes = create_recipes(list(pending.values()), images)
+        change_counters(Recipe, recipes, 1)
+        followed = set(
+            User.objects.filter(
+                id__in={recipe.author_id for recipe in recipes},
+                followers_count__gt=0
+            ).values_list('id', flat=True)
+        )
+        for recipe in recipes:
+            if recipe.author_id in followed:
+                transaction.on_commit(partial(fan_out_recipe, recipe.id))
+    return len(recipes), len(rows) - len(recipes)
+
+
+def import_recipes(root, workers=0, chunk_size=CHUNK_SIZE):
+    """Загрузить рецепты из каталога архива.
+
+    Части архива записываются в пуле из workers процессов, при
+    workers = 0 в текущем процессе. Процессы запускаются через spawn и
+    открывают свои соединения с БД, а не наследуют соединение
+    основного процесса. Каждая часть записывается в своей
+    транзакции. Возвращает счетчики добавленных записей.
+    """
+    stats = Counter()
+
+    def collect(results):
+        for created, skipped in results:
+            stats['recipes'] += created
+            stats['skipped'] += skipped
+
+    try:
+        if not workers:
+            for chunk in read_chunks(root, chunk_size):
+                collect([import_chunk(root, resolve_references(chunk, stats))])
+            return stats
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=django.setup
+        ) as pool:
+            running = set()
+            for chunk in read_chunks(root, chunk_size):
+                running.add(pool.submit(
+                    import_chunk, root, resolve_references(chunk, stats)
+                ))
+                if len(running) >= workers * 2:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(future.result() for future in done)
+            collect(future.result() for future in running)
+        return stats
+    finally:
+        versions = []
+        if stats['recipes']:
+            versions += [RECIPE_LIST_VERSION, count_version_name(Recipe)]
+        if stats['authors']:
+            versions.append(count_version_name(User))
+        if stats['tags']:
+            versions.append(TAGS_VERSION)
+        if stats['ingredients']:
+            versions.append(INGREDIENTS_VERSION)
+        if versions:
+            bump_versions(*versions)
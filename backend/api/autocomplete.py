@@ -0,0 +1,47 @@
+from bisect import bisect_left
+
+from . import reference
+
+
+def normalize(text):
+    """Привести название к виду для поиска: регистр, ё и пробелы."""
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+class PrefixIndex:
+    """Отсортированный индекс нормализованных названий ингредиентов."""
+
+    def __init__(self, ingredients):
+        entries = sorted(
+            (normalize(ingredient.name), ingredient.pk, ingredient)
+            for ingredient in ingredients
+        )
+        self.keys = [key for key, pk, ingredient in entries]
+        self.ingredients = [ingredient for key, pk, ingredient in entries]
+
+    def search(self, query, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        query = normalize(query)
+        results = []
+        start = bisect_left(self.keys, query)
+        for index in range(start, len(self.keys)):
+            if len(results) >= limit or not self.keys[index].startswith(
+                query
+            ):
+                break
+            results.append(self.ingredients[index])
+        if not query:
+            return results
+        for key, ingredient in zip(self.keys, self.ingredients):
+            if len(results) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                results.append(ingredient)
+        return results
+
+
+def search_ingredients(query, limit):
+    """Найти ингредиенты по названию без запросов к БД."""
+    return reference.ingredients.derive(PrefixIndex, PrefixIndex).search(
+        query, limit
+    )
@@ -0,0 +1,107 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'foodgram:version:{}'
+
+
+def new_version():
+    """Новое значение версии.
+
+    Версия строится от текущего времени, а не от счетчика: если ключ
+    вытеснен из кэша, новая версия не совпадет ни с одной из прежних.
+    """
+    return time.time_ns()
+
+
+def get_versions(*names):
+    """Текущие версии наборов данных, отсутствующие создаются."""
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def get_version(name):
+    """Текущая версия набора данных."""
+    return get_versions(name)[0]
+
+
+def bump_versions(*names):
+    """Сменить версии наборов данных после фиксации транзакции."""
+    def bump():
+        version = new_version()
+        cache.set_many(
+            {VERSION_KEY.format(name): version for name in names},
+            timeout=None
+        )
+    transaction.on_commit(bump)
+
+
+def count_version_name(model):
+    """Имя версии количества записей модели."""
+    return f'count:{model._meta.label_lower}'
+
+
+# Общая версия данных рецептов: меняется при изменении тегов и ингредиентов
+RECIPES_VERSION = 'recipes'
+# Версия списка рецептов: меняется при изменении любого рецепта
+RECIPE_LIST_VERSION = 'recipe-list'
+# Версии справочников
+TAGS_VERSION = 'tags'
+INGREDIENTS_VERSION = 'ingredients'
+# Версия рейтинга популярности: меняется при каждом пересчете
+POPULARITY_VERSION = 'popularity'
+
+
+def recipe_version_name(recipe_id):
+    """Имя версии данных рецепта."""
+    return f'recipe:{recipe_id}'
+
+
+def user_version_name(user_id):
+    """Имя версии отметок пользователя: избранное, покупки, подписки."""
+    return f'user:{user_id}'
+
+
+def invalidate_recipes(*recipe_ids):
+    """Сбросить кэш данных указанных рецептов."""
+    bump_versions(RECIPE_LIST_VERSION, *map(recipe_version_name, recipe_ids))
+
+
+def invalidate_all_recipes():
+    """Сбросить кэш данных всех рецептов."""
+    bump_versions(RECIPES_VERSION)
+
+
+def get_recipe_payload_keys(recipe_ids, snapshot=None):
+    """Ключи кэша данных рецептов с учетом текущих версий.
+
+    Вторым значением возвращается, можно ли записывать в кэш данные,
+    загруженные из БД: snapshot — версии {имя: значение}, прочитанные
+    до загрузки рецептов. Если какая-то из них сменилась, данные могли
+    быть прочитаны до изменения и не соответствуют текущим версиям.
+    Любой сброс данных рецепта меняет и версию списка рецептов.
+    """
+    names = [
+        RECIPES_VERSION,
+        RECIPE_LIST_VERSION,
+        *map(recipe_version_name, recipe_ids)
+    ]
+    versions = dict(zip(names, get_versions(*names)))
+    keys = {
+        recipe_id: (
+            f'foodgram:recipe:{recipe_id}:{versions[RECIPES_VERSION]}:'
+            f'{versions[recipe_version_name(recipe_id)]}'
+        )
+        for recipe_id in recipe_ids
+    }
+    writable = snapshot is not None and all(
+        versions.get(name, version) == version
+        for name, version in snapshot.items()
+    )
+    return keys, writable
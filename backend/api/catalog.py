@@ -0,0 +1,287 @@
+import csv
+import json
+import re
+from collections import namedtuple
+from itertools import islice
+from pathlib import Path
+
+from django.db import connection
+from recipes.models import Ingredient, Tag
+
+from .cache import (INGREDIENTS_VERSION, TAGS_VERSION, bump_versions,
+                    invalidate_all_recipes)
+from .shopping_list import Echo
+
+# Число записей справочника, обрабатываемых за один раз
+BATCH_SIZE: int = 5000
+# Размер части файла, читаемой за один раз
+READ_CHUNK_SIZE: int = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+Catalog = namedtuple('Catalog', ('model', 'key', 'fields', 'version'))
+LoadResult = namedtuple('LoadResult', ('inserted', 'updated', 'unchanged'))
+
+# Справочники: модель, естественный ключ, поля в порядке столбцов файла
+INGREDIENTS = Catalog(
+    Ingredient,
+    ('name', 'measurement_unit'),
+    ('name', 'measurement_unit'),
+    INGREDIENTS_VERSION
+)
+TAGS = Catalog(Tag, ('slug',), ('name', 'color', 'slug'), TAGS_VERSION)
+
+
+class JsonArrayReader:
+    """Элементы JSON-массива по одному, без чтения файла целиком."""
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.position, self.eof = '', 0, False
+
+    def fill(self):
+        """Дочитать часть файла, отбросив разобранное начало буфера."""
+        chunk = self.file.read(READ_CHUNK_SIZE)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+
+    def peek(self):
+        """Следующий непробельный символ."""
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.eof:
+                raise ValueError('Неожиданный конец JSON-файла.')
+            self.fill()
+
+    def value(self):
+        """Следующее значение; неполное значение дочитывается из файла."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            if end < len(self.buffer) or self.eof:
+                self.position = end
+                return value
+            self.fill()
+
+    def __iter__(self):
+        if self.peek() != '[':
+            raise ValueError('Ожидается JSON-массив.')
+        self.position += 1
+        if self.peek() == ']':
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.position += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Некорректный JSON: {char!r} вместо ",".')
+
+
+def read_rows(catalog, file, path):
+    """Проверенные записи справочника из файла CSV или JSON.
+
+    Запись в CSV без заголовка, столбцы в порядке catalog.fields;
+    в JSON объекты с такими ключами.
+    """
+    if Path(path).suffix == '.json':
+        rows = (
+            [item.get(field) for field in catalog.fields]
+            if isinstance(item, dict) else None
+            for item in JsonArrayReader(file)
+        )
+    else:
+        rows = (row for row in csv.reader(file) if row)
+    for number, row in enumerate(rows, 1):
+        if row is None or len(row) != len(catalog.fields):
+            raise ValueError(
+                f'{path}, запись {number}: ожидаются поля '
+                f'{", ".join(catalog.fields)}.'
+            )
+        values = []
+        for field, value in zip(catalog.fields, row):
+            value = '' if value is None else str(value).strip()
+            max_length = catalog.model._meta.get_field(field).max_length
+            if not value or len(value) > max_length:
+                raise ValueError(
+                    f'{path}, запись {number}: поле {field} должно быть '
+                    f'непустым и не длиннее {max_length} символов.'
+                )
+            values.append(value)
+        yield tuple(values)
+
+
+def get_key(catalog, values):
+    return tuple(
+        value for field, value in zip(catalog.fields, values)
+        if field in catalog.key
+    )
+
+
+def upsert_batch(catalog, rows, update=True):
+    """Записать часть справочника: {ключ: значения полей}.
+
+    Существующие записи выбираются одним запросом, новые добавляются
+    одним INSERT с набором параметров, изменившиеся обновляются
+    через bulk_update. При update=False существующие записи
+    не изменяются.
+    """
+    model = catalog.model
+    existing = {
+        get_key(catalog, values): (pk, values)
+        for pk, *values in model.objects.filter(**{
+            f'{catalog.key[0]}__in': {key[0] for key in rows}
+        }).values_list('id', *catalog.fields)
+    }
+    new, changed = [], []
+    for key, values in rows.items():
+        if key not in existing:
+            new.append(values)
+        elif update and tuple(existing[key][1]) != values:
+            changed.append(model(
+                id=existing[key][0], **dict(zip(catalog.fields, values))
+            ))
+    if new:
+        columns = [
+            model._meta.get_field(field).column for field in catalog.fields
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {model._meta.db_table} ({", ".join(columns)}) '
+                f'VALUES ({", ".join(["%s"] * len(columns))})',
+                new
+            )
+    if changed:
+        model.objects.bulk_update(
+            changed,
+            [field for field in catalog.fields if field not in catalog.key]
+        )
+    return LoadResult(
+        len(new), len(changed), len(rows) - len(new) - len(changed)
+    )
+
+
+class CsvStream:
+    """Файлоподобный объект с записями в CSV для COPY ... FROM STDIN."""
+
+    def __init__(self, rows):
+        writer = csv.writer(Echo())
+        self.lines = (writer.writerow(row) for row in rows)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_catalog(catalog, rows):
+    """Записать справочник через COPY во временную таблицу PostgreSQL.
+
+    Повторяющиеся ключи схлопываются до последней записи, затем
+    изменившиеся строки обновляются, отсутствующие добавляются.
+    """
+    table = catalog.model._meta.db_table
+    columns = [
+        catalog.model._meta.get_field(field).column
+        for field in catalog.fields
+    ]
+    keys = [
+        catalog.model._meta.get_field(field).column
+        for field in catalog.key
+    ]
+    updates = [column for column in columns if column not in keys]
+    column_list = ', '.join(columns)
+    key_list = ', '.join(keys)
+    source = (
+        f'(SELECT DISTINCT ON ({key_list}) {column_list} '
+        f'FROM catalog_staging ORDER BY {key_list}, position DESC) AS source'
+    )
+    key_match = ' AND '.join(f'target.{key} = source.{key}' for key in keys)
+    assignments = ', '.join(
+        f'{column} = source.{column}' for column in updates
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE catalog_staging (position serial, '
+            f'{", ".join(f"{column} text" for column in columns)})'
+        )
+        cursor.copy_expert(
+            f'COPY catalog_staging ({column_list}) FROM STDIN '
+            'WITH (FORMAT csv)',
+            CsvStream(rows)
+        )
+        cursor.execute(f'SELECT count(*) FROM {source}')
+        total = cursor.fetchone()[0]
+        updated = 0
+        if updates:
+            cursor.execute(
+                f'UPDATE {table} AS target SET {assignments} '
+                f'FROM {source} WHERE {key_match} AND '
+                f'({", ".join(f"target.{column}" for column in updates)}) '
+                'IS DISTINCT FROM '
+                f'({", ".join(f"source.{column}" for column in updates)})'
+            )
+            updated = cursor.rowcount
+        cursor.execute(
+            f'INSERT INTO {table} ({column_list}) '
+            f'SELECT {column_list} FROM {source} WHERE NOT EXISTS '
+            f'(SELECT 1 FROM {table} AS target WHERE {key_match})'
+        )
+        inserted = cursor.rowcount
+        cursor.execute('DROP TABLE catalog_staging')
+    return LoadResult(inserted, updated, total - inserted - updated)
+
+
+def load_catalog(catalog, path, batch_size=BATCH_SIZE):
+    """Загрузить справочник из файла с обновлением по естественному ключу.
+
+    Файл читается потоком. В PostgreSQL записи передаются через COPY,
+    в остальных БД частями по batch_size записей.
+    """
+    with open(path, encoding='utf-8', newline='') as file:
+        rows = read_rows(catalog, file, path)
+        if connection.vendor == 'postgresql':
+            return copy_catalog(catalog, rows)
+        result = LoadResult(0, 0, 0)
+        while True:
+            batch = {
+                get_key(catalog, values): values
+                for values in islice(rows, batch_size)
+            }
+            if not batch:
+                return result
+            result = LoadResult(*map(
+                sum, zip(result, upsert_batch(catalog, batch))
+            ))
+
+
+def invalidate_catalog(catalog, result):
+    """Сбросить кэш после загрузки справочника.
+
+    Записи пишутся без сигналов изменения тегов и ингредиентов. Новые
+    записи меняют версию справочника, измененные — еще и общую версию
+    данных рецептов, в которые встроены их названия и цвета.
+    """
+    if result.inserted or result.updated:
+        bump_versions(catalog.version)
+    if result.updated:
+        invalidate_all_recipes()
@@ -0,0 +1,53 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow
+
+User = get_user_model()
+
+# Денормализованные счетчики: модель записи, поле связи с объектом
+# счетчика, модель объекта и поле счетчика
+COUNTERS = (
+    (Favorite, 'recipe', Recipe, 'favorites_count'),
+    (ShoppingCart, 'recipe', Recipe, 'shopping_carts_count'),
+    (Follow, 'following', User, 'followers_count'),
+    (Recipe, 'author', User, 'recipes_count'),
+)
+
+
+def change_counters(sender, instances, sign):
+    """Изменить счетчики при создании (sign=1) или удалении (sign=-1)
+    записей модели sender.
+
+    Объекты с одинаковым приращением обновляются одним UPDATE.
+    """
+    for source, field, model, counter in COUNTERS:
+        if source is not sender:
+            continue
+        deltas = Counter(
+            getattr(instance, f'{field}_id') for instance in instances
+        )
+        ids_by_delta = {}
+        for object_id, delta in deltas.items():
+            ids_by_delta.setdefault(delta, []).append(object_id)
+        for delta, ids in ids_by_delta.items():
+            model.objects.filter(pk__in=ids).update(
+                **{counter: F(counter) + sign * delta}
+            )
+
+
+def count_related(source, field):
+    """Фактическое значение счетчика для подзапроса."""
+    return Coalesce(
+        Subquery(
+            source.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.db.models import Q
+from recipes.models import FeedItem, Recipe
+from users.models import Follow
+
+from .pagination import KeysetPagination
+
+
+def fan_out_recipe(recipe_id):
+    """Добавить рецепт в ленты подписчиков автора.
+
+    Вызывается после фиксации транзакции публикации, ленты заполняются
+    пакетами по FEED_FANOUT_BATCH_SIZE подписчиков. Рецепты авторов,
+    у которых подписчиков больше FEED_FANOUT_THRESHOLD, не рассылаются.
+    """
+    recipe = Recipe.objects.select_related('author').filter(
+        id=recipe_id
+    ).first()
+    if (recipe is None
+            or recipe.author.followers_count
+            > settings.FEED_FANOUT_THRESHOLD):
+        return
+    followers = Follow.objects.filter(
+        following_id=recipe.author_id
+    ).order_by('user_id').values_list('user_id', flat=True)
+    last_user_id = 0
+    while True:
+        user_ids = list(followers.filter(
+            user_id__gt=last_user_id
+        )[:settings.FEED_FANOUT_BATCH_SIZE])
+        if not user_ids:
+            return
+        last_user_id = user_ids[-1]
+        FeedItem.objects.bulk_create(
+            [
+                FeedItem(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    pub_date=recipe.pub_date
+                )
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True
+        )
+
+
+def backfill_follow(user_id, author_id):
+    """Добавить в ленту последние рецепты автора после подписки."""
+    followers_count = Follow.objects.filter(
+        user_id=user_id, following_id=author_id
+    ).values_list('following__followers_count', flat=True).first()
+    if (followers_count is None
+            or followers_count > settings.FEED_FANOUT_THRESHOLD):
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL_LIMIT]
+    FeedItem.objects.bulk_create(
+        [
+            FeedItem(user_id=user_id, recipe_id=recipe_id, pub_date=pub_date)
+            for recipe_id, pub_date in recipes
+        ],
+        ignore_conflicts=True
+    )
+
+
+def trim_follow(user_id, author_id):
+    """Убрать из ленты рецепты автора после отписки."""
+    FeedItem.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def after_position(queryset, position, id_field):
+    """Записи, идущие в ленте после позиции (дата, id)."""
+    if position is None:
+        return queryset
+    pub_date, recipe_id = position
+    return queryset.filter(
+        Q(pub_date__lt=pub_date)
+        | Q(pub_date=pub_date, **{f'{id_field}__lt': recipe_id})
+    )
+
+
+def get_feed_positions(user, position, limit):
+    """Позиции (дата, id) рецептов ленты после position.
+
+    Записи таблицы лент объединяются с рецептами авторов, которые
+    не рассылаются из-за большого числа подписчиков. Обе выборки
+    идут по индексам (пользователь, дата) и (автор, дата).
+    """
+    entries = after_position(
+        FeedItem.objects.filter(user=user), position, 'recipe_id'
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[:limit]
+    popular_authors = Follow.objects.filter(
+        user=user,
+        following__followers_count__gt=settings.FEED_FANOUT_THRESHOLD
+    ).values('following_id')
+    fan_out_on_read = after_position(
+        Recipe.objects.filter(author__in=popular_authors), position, 'id'
+    ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit]
+    return sorted(
+        set(entries) | set(fan_out_on_read), reverse=True
+    )[:limit]
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты подписок.
+
+    Id рецептов страницы выбираются из таблицы лент, сами рецепты
+    загружаются из переданного queryset.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        positions = get_feed_positions(
+            request.user, self.decode_cursor(request), self.page_size + 1
+        )
+        self.has_next = len(positions) > self.page_size
+        recipe_ids = [
+            recipe_id for _, recipe_id in positions[:self.page_size]
+        ]
+        recipes = queryset.in_bulk(recipe_ids)
+        page = [
+            recipes[recipe_id] for recipe_id in recipe_ids
+            if recipe_id in recipes
+        ]
+        self.last_instance = page[-1] if page else None
+        return page
@@ -0,0 +1,108 @@
+import binascii
+from base64 import b64decode
+from contextlib import contextmanager
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.uploadedfile import (TemporaryUploadedFile,
+                                            UploadedFile)
+from PIL import Image
+from rest_framework import serializers
+
+# Размер части base64-строки, декодируемой за один раз (кратен 4)
+BASE64_CHUNK_SIZE: int = 64 * 1024
+# Допустимые форматы изображений и расширения файлов
+IMAGE_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+
+class Base64ImageFileField(serializers.ImageField):
+    """Изображение в base64 с декодированием по частям во временный файл.
+
+    Размер файла проверяется по длине строки до декодирования, размеры
+    изображения и формат по заголовку файла до загрузки пикселей.
+    """
+    default_error_messages = {
+        'invalid_base64': 'Некорректная строка base64.',
+        'too_large': 'Размер файла больше {max_size} байт.',
+        'too_many_pixels': 'Изображение больше {max_pixels} пикселей.',
+        'invalid_format': 'Допустимые форматы: {formats}.',
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or not data:
+            self.fail('invalid')
+        if data.startswith('data:'):
+            _, _, data = data.partition(';base64,')
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if len(data) // 4 * 3 > max_size:
+            self.fail('too_large', max_size=max_size)
+        upload = TemporaryUploadedFile(
+            'image', 'application/octet-stream', None, None
+        )
+        try:
+            for start in range(0, len(data), BASE64_CHUNK_SIZE):
+                upload.write(b64decode(
+                    data[start:start + BASE64_CHUNK_SIZE], validate=True
+                ))
+            upload.size = upload.tell()
+            upload.seek(0)
+            image_format = self.validate_image(upload)
+        except (binascii.Error, ValueError):
+            upload.close()
+            self.fail('invalid_base64')
+        except serializers.ValidationError:
+            upload.close()
+            raise
+        upload.seek(0)
+        upload.name = f'{uuid4()}.{IMAGE_FORMATS[image_format]}'
+        upload.content_type = Image.MIME[image_format]
+        return upload
+
+    def validate_image(self, upload):
+        """Проверить изображение и вернуть его формат."""
+        try:
+            with Image.open(upload) as image:
+                image_format = image.format
+                width, height = image.size
+                if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+                    self.fail(
+                        'too_many_pixels',
+                        max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS
+                    )
+                image.verify()
+        except (OSError, SyntaxError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        if image_format not in IMAGE_FORMATS:
+            self.fail('invalid_format', formats=', '.join(IMAGE_FORMATS))
+        return image_format
+
+
+@contextmanager
+def stored_upload(validated_data, model_field):
+    """Сохранить загруженный файл в хранилище до открытия транзакции.
+
+    В validated_data файл заменяется именем в хранилище, так что в
+    транзакции записывается только путь. Если блок завершился ошибкой,
+    файл удаляется.
+    """
+    upload = validated_data.get(model_field.name)
+    if not isinstance(upload, UploadedFile):
+        yield
+        return
+    name = model_field.storage.save(
+        model_field.generate_filename(None, upload.name),
+        upload,
+        max_length=model_field.max_length
+    )
+    upload.close()
+    validated_data[model_field.name] = name
+    try:
+        yield
+    except BaseException:
+        model_field.storage.delete(name)
+        raise
@@ -1,7 +1,10 @@
-from django_filters import (CharFilter, FilterSet, ModelMultipleChoiceFilter,
-                            NumberFilter)
+from django.db.models import F
+from django_filters import (CharFilter, ChoiceFilter, FilterSet,
+                            ModelMultipleChoiceFilter, NumberFilter)
 from recipes.models import Tag
 
+from .search import search_recipes
+
 
 class RecipesFilter(FilterSet):
 
@@ -19,6 +22,13 @@ class RecipesFilter(FilterSet):
     author = NumberFilter(
         field_name='author__id',
     )
+    search = CharFilter(
+        method='filter_search'
+    )
+    ordering = ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering'
+    )
 
     def filter_is_favorited(self, queryset, name, value):
         if value:
@@ -34,8 +44,18 @@ class RecipesFilter(FilterSet):
             )
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
 
-class IngredientFilter(FilterSet):
-    name = CharFilter(
-        lookup_expr='startswith'
-    )
+    def filter_ordering(self, queryset, name, value):
+        """Сортировка по рейтингу популярности.
+
+        Курсорная пагинация всегда сортирует по дате публикации.
+        """
+        if value == 'popular':
+            return queryset.order_by(
+                F('popularity__score').desc(nulls_last=True),
+                '-pub_date',
+                '-id'
+            )
+        return queryset
@@ -0,0 +1,223 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from pathlib import PurePosixPath
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+from recipes.models import Recipe
+
+from .cache import invalidate_recipes
+
+logger = logging.getLogger(__name__)
+
+# Наибольшие размеры вариантов изображения рецепта (ширина, высота)
+VARIANT_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+# Форматы вариантов: расширение и формат Pillow
+VARIANT_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+# Качество сжатия вариантов
+VARIANT_QUALITY: int = 80
+# Каталог вариантов в хранилище
+VARIANTS_DIRECTORY = 'recipes/variants'
+
+_process_pool = None
+_thread_pool = None
+# Места в очереди обработки, создаются вместе с пулом потоков
+_queue_slots = None
+
+
+def render_variants(content):
+    """Уменьшенные копии изображения во всех размерах и форматах.
+
+    Возвращает словарь {вариант: {расширение: байты}}.
+    """
+    with Image.open(BytesIO(content)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    rendered = {}
+    for variant, size in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        rendered[variant] = {}
+        for extension, image_format in VARIANT_FORMATS:
+            if image_format == 'JPEG' and resized.mode == 'RGBA':
+                background = Image.new('RGB', resized.size, (255, 255, 255))
+                background.paste(resized, mask=resized.getchannel('A'))
+                target = background
+            else:
+                target = resized
+            buffer = BytesIO()
+            target.save(
+                buffer,
+                image_format,
+                quality=VARIANT_QUALITY,
+                optimize=image_format == 'JPEG'
+            )
+            rendered[variant][extension] = buffer.getvalue()
+    return rendered
+
+
+def build_variants(image_name):
+    """Создать варианты изображения из хранилища и сохранить их.
+
+    Выполняется в рабочем процессе и не обращается к БД. Возвращает
+    словарь для поля Recipe.image_variants.
+    """
+    with default_storage.open(image_name, 'rb') as source:
+        rendered = render_variants(source.read())
+    stem = PurePosixPath(image_name).stem
+    variants = {'source': image_name}
+    for variant, formats in rendered.items():
+        variants[variant] = {
+            extension: default_storage.save(
+                f'{VARIANTS_DIRECTORY}/{stem}_{variant}.{extension}',
+                ContentFile(content)
+            )
+            for extension, content in formats.items()
+        }
+    return variants
+
+
+def variant_names(variants):
+    """Имена файлов вариантов из значения Recipe.image_variants."""
+    return {
+        name
+        for variant in VARIANT_SIZES
+        for name in variants.get(variant, {}).values()
+    }
+
+
+def save_variants(recipe_id, variants):
+    """Записать варианты в рецепт, если его изображение не сменилось.
+
+    Файлы прежних вариантов удаляются, устаревший результат
+    удаляется целиком.
+    """
+    previous = Recipe.objects.filter(id=recipe_id).values_list(
+        'image_variants', flat=True
+    ).first()
+    updated = Recipe.objects.filter(
+        id=recipe_id, image=variants['source']
+    ).update(image_variants=variants)
+    obsolete = variant_names(variants)
+    if updated:
+        invalidate_recipes(recipe_id)
+        obsolete = variant_names(previous or {}) - obsolete
+    for name in obsolete:
+        default_storage.delete(name)
+    return bool(updated)
+
+
+def get_process_pool():
+    """Пул процессов для обработки изображений.
+
+    Создается из потока пула, поэтому процессы запускаются через spawn:
+    fork из многопоточного процесса копирует захваченные блокировки.
+    Процессы сами настраивают Django и не открывают соединений с БД.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=get_context('spawn'),
+            initializer=django.setup
+        )
+    return _process_pool
+
+
+def process_image(recipe_id, image_name):
+    """Создать варианты в пуле процессов и записать их в рецепт.
+
+    Выполняется в отдельном потоке, который закрывает свое
+    соединение с БД.
+    """
+    try:
+        variants = get_process_pool().submit(
+            build_variants, image_name
+        ).result()
+        save_variants(recipe_id, variants)
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение рецепта %s', recipe_id
+        )
+    finally:
+        connection.close()
+        _queue_slots.release()
+
+
+def schedule_variants(recipe_id, image_name):
+    """Поставить обработку изображения рецепта в очередь.
+
+    При IMAGE_WORKERS = 0 варианты создаются сразу в текущем процессе.
+    Если в очереди уже IMAGE_QUEUE_LIMIT изображений, обработка
+    пропускается: рецепт отдает оригинал, пока варианты не создаст
+    команда build_image_variants.
+    """
+    global _thread_pool, _queue_slots
+    if not settings.IMAGE_WORKERS:
+        save_variants(recipe_id, build_variants(image_name))
+        return
+    if _thread_pool is None:
+        _queue_slots = threading.BoundedSemaphore(settings.IMAGE_QUEUE_LIMIT)
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    if not _queue_slots.acquire(blocking=False):
+        logger.warning(
+            'Очередь изображений заполнена, рецепт %s пропущен', recipe_id
+        )
+        return
+    _thread_pool.submit(process_image, recipe_id, image_name)
+
+
+def variants_ready(recipe):
+    """Готовы ли варианты текущего изображения рецепта."""
+    return not recipe.image or (
+        (recipe.image_variants or {}).get('source') == recipe.image.name
+    )
+
+
+def get_image_name(recipe, variant, extension='jpeg'):
+    """Имя файла варианта или оригинала, если вариант еще не готов."""
+    if recipe.image and variants_ready(recipe):
+        name = recipe.image_variants.get(variant, {}).get(extension)
+        if name:
+            return name
+    return recipe.image.name or None
+
+
+def get_image_url(recipe, variant, extension='jpeg'):
+    """Относительный URL варианта изображения рецепта."""
+    name = get_image_name(recipe, variant, extension)
+    return recipe.image.storage.url(name) if name else None
+
+
+def get_image_urls(recipe):
+    """Относительные URL всех готовых вариантов изображения."""
+    if not recipe.image or not variants_ready(recipe):
+        return {}
+    return {
+        variant: {
+            extension: recipe.image.storage.url(name)
+            for extension, name in recipe.image_variants.get(
+                variant, {}
+            ).items()
+        }
+        for variant in VARIANT_SIZES
+    }
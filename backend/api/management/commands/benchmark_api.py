@@ -0,0 +1,214 @@
+import json
+import math
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Recipe, ShoppingCart, Tag
+from rest_framework.test import APIClient
+
+User = get_user_model()
+
+# Процентили времени ответа в отчете
+PERCENTILES = (50, 90, 99)
+# Процентиль, по которому время ответа сравнивается с базовым: медиана
+# устойчивее к единичным задержкам, чем хвостовые процентили
+COMPARED_PERCENTILE = 'p50'
+# Рост времени ответа меньше этого значения (мс) считается шумом
+LATENCY_NOISE_MS: float = 2.0
+# Управление транзакциями не учитывается в числе запросов
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO')
+
+
+def get_queries(context):
+    """SQL-запросы блока без команд управления транзакциями."""
+    return [
+        query['sql'] for query in context.captured_queries
+        if not query['sql'].startswith(TRANSACTION_STATEMENTS)
+    ]
+
+
+def percentile(values, percent):
+    """Процентиль по ближайшему рангу."""
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер времени ответа и числа SQL-запросов основных эндпоинтов '
+        'API со сравнением с базовыми значениями из файла'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=30,
+            help='Количество замеров каждого эндпоинта'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=3,
+            help='Количество запросов до начала замеров'
+        )
+        parser.add_argument(
+            '--user',
+            help='Email пользователя, от имени которого идут запросы'
+        )
+        parser.add_argument(
+            '--baseline',
+            default='benchmark_baseline.json',
+            help='Файл базовых значений'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Записать результаты в файл базовых значений'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Допустимый относительный рост времени ответа'
+        )
+
+    def get_user(self, email):
+        """Пользователь из параметра или с самым большим списком покупок."""
+        if email:
+            user = User.objects.filter(email=email).first()
+        else:
+            user_id = ShoppingCart.objects.values('user_id').annotate(
+                recipes=Count('id')
+            ).order_by('-recipes').values_list('user_id', flat=True).first()
+            user = User.objects.filter(id=user_id).first()
+        if user is None:
+            raise CommandError(
+                'Пользователь не найден, создайте данные командой '
+                'generate_data'
+            )
+        return user
+
+    def get_endpoints(self):
+        """Метки и URL эндпоинтов с параметрами по имеющимся данным."""
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        if recipe is None:
+            raise CommandError(
+                'Нет рецептов, создайте данные командой generate_data'
+            )
+        tag = Tag.objects.annotate(
+            recipes_count=Count('recipes')
+        ).order_by('-recipes_count').first()
+        author_id = User.objects.order_by('-recipes_count').values_list(
+            'id', flat=True
+        ).first()
+        ingredient = recipe.ingredients.order_by('name').first()
+        search = urlencode({'search': recipe.name.split()[0].strip(':')})
+        autocomplete = urlencode({'name': ingredient.name[:3]})
+        recipes_url = '/api/recipes/'
+        return (
+            ('recipe-list', recipes_url),
+            ('recipe-list-tags', f'{recipes_url}?tags={tag.slug}'),
+            ('recipe-list-author', f'{recipes_url}?author={author_id}'),
+            ('recipe-list-favorited', f'{recipes_url}?is_favorited=1'),
+            (
+                'recipe-list-shopping-cart',
+                f'{recipes_url}?is_in_shopping_cart=1'
+            ),
+            ('recipe-list-search', f'{recipes_url}?{search}'),
+            ('recipe-list-popular', f'{recipes_url}?ordering=popular'),
+            ('recipe-detail', f'{recipes_url}{recipe.id}/'),
+            ('recipe-feed', f'{recipes_url}feed/'),
+            ('subscriptions', '/api/users/subscriptions/?recipes_limit=3'),
+            (
+                'download-shopping-cart',
+                f'{recipes_url}download_shopping_cart/'
+            ),
+            ('ingredient-autocomplete', f'/api/ingredients/?{autocomplete}'),
+        )
+
+    def measure(self, client, label, url, options):
+        """Время ответа в мс и наибольшее число SQL-запросов."""
+        durations = []
+        queries = 0
+        for iteration in range(options['warmup'] + options['iterations']):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                duration = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise CommandError(f'{label}: статус {response.status_code}')
+            if iteration >= options['warmup']:
+                durations.append(duration)
+                queries = max(queries, len(get_queries(context)))
+        result = {
+            f'p{percent}': round(percentile(durations, percent), 2)
+            for percent in PERCENTILES
+        }
+        result['queries'] = queries
+        return result
+
+    def compare(self, label, result, baseline, tolerance):
+        """Описание регрессии относительно базовых значений или None."""
+        if baseline is None:
+            return None
+        if result['queries'] > baseline['queries']:
+            return (
+                f'{label}: запросов {result["queries"]}, '
+                f'базовое значение {baseline["queries"]}'
+            )
+        latency = result[COMPARED_PERCENTILE]
+        allowed = baseline[COMPARED_PERCENTILE] * (1 + tolerance)
+        if (latency > allowed
+                and latency - baseline[COMPARED_PERCENTILE]
+                > LATENCY_NOISE_MS):
+            return (
+                f'{label}: {COMPARED_PERCENTILE} {latency} мс, '
+                f'базовое значение {baseline[COMPARED_PERCENTILE]} мс'
+            )
+        return None
+
+    def handle(self, *args, **options):
+        client = APIClient()
+        client.force_authenticate(self.get_user(options['user']))
+        baseline_path = Path(options['baseline'])
+        baseline = {}
+        if baseline_path.is_file() and not options['save_baseline']:
+            baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        results = {}
+        regressions = []
+        for label, url in self.get_endpoints():
+            result = self.measure(client, label, url, options)
+            results[label] = result
+            self.stdout.write(
+                f'{label:<28}'
+                + ''.join(
+                    f' p{percent} {result[f"p{percent}"]:8.2f} мс'
+                    for percent in PERCENTILES
+                )
+                + f'  запросов {result["queries"]}'
+            )
+            regression = self.compare(
+                label, result, baseline.get(label), options['tolerance']
+            )
+            if regression:
+                regressions.append(regression)
+        if options['save_baseline']:
+            baseline_path.write_text(
+                json.dumps(results, indent=2, sort_keys=True) + '\n',
+                encoding='utf-8'
+            )
+            self.stdout.write(f'Базовые значения записаны в {baseline_path}')
+        if regressions:
+            raise CommandError(
+                'Производительность ухудшилась:\n' + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
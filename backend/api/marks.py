@@ -0,0 +1,99 @@
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from .cache import bump_versions, user_version_name
+from .counters import change_counters
+
+
+def can_return_rows():
+    """Поддерживает ли БД RETURNING в INSERT и DELETE."""
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35)
+    )
+
+
+def insert_marks(model, user_id, field, target_ids):
+    """Добавить отметки пользователя, пропуская существующие.
+
+    Возвращает id целей, для которых строка действительно вставлена:
+    bulk_create(ignore_conflicts=True) молча пропускает строки,
+    добавленные одновременным запросом. Используется INSERT ... ON
+    CONFLICT DO NOTHING RETURNING, без поддержки RETURNING строки
+    вставляются по одной. Сигналы post_save не отправляются.
+    """
+    meta = model._meta
+    columns = (
+        meta.get_field('user').column,
+        meta.get_field(field).column,
+        meta.get_field('created').column,
+    )
+    created = meta.get_field('created').get_db_prep_save(
+        timezone.now(), connection
+    )
+    rows = [(user_id, target_id, created) for target_id in target_ids]
+    sql = (
+        f'INSERT INTO {meta.db_table} ({", ".join(columns)}) '
+        'VALUES {} ON CONFLICT DO NOTHING'
+    )
+    row_sql = '(%s, %s, %s)'
+    with connection.cursor() as cursor:
+        if can_return_rows():
+            cursor.execute(
+                sql.format(', '.join([row_sql] * len(rows)))
+                + f' RETURNING {columns[1]}',
+                [value for row in rows for value in row]
+            )
+            return {target_id for target_id, in cursor.fetchall()}
+        inserted = set()
+        for row in rows:
+            cursor.execute(sql.format(row_sql), row)
+            if cursor.rowcount:
+                inserted.add(row[1])
+        return inserted
+
+
+def delete_marks(model, user_id, field, target_ids):
+    """Удалить отметки пользователя, вернуть id действительно удаленных.
+
+    QuerySet.delete() сначала выбирает строки и отправляет post_delete
+    для каждой выбранной, даже если ее уже удалил одновременный запрос,
+    поэтому счетчики уменьшались несколько раз. Здесь строки удаляются
+    одним DELETE ... RETURNING (без поддержки RETURNING — по одной), и
+    сигнал отправляется только для удаленных. Счетчики и версия
+    отметок пользователя меняются здесь же, а не в обработчиках
+    post_delete: обработчики отключили бы быстрое каскадное удаление
+    отметок вместе с рецептом. На отметки не ссылаются другие модели,
+    каскадного удаления нет. Вызывается в транзакции.
+    """
+    meta = model._meta
+    user_column = meta.get_field('user').column
+    column = meta.get_field(field).column
+    sql = f'DELETE FROM {meta.db_table} WHERE {user_column} = %s AND '
+    with connection.cursor() as cursor:
+        if can_return_rows():
+            cursor.execute(
+                sql + f'{column} IN ({", ".join(["%s"] * len(target_ids))}) '
+                f'RETURNING {column}',
+                [user_id, *target_ids]
+            )
+            deleted = {target_id for target_id, in cursor.fetchall()}
+        else:
+            deleted = set()
+            for target_id in target_ids:
+                cursor.execute(sql + f'{column} = %s', [user_id, target_id])
+                if cursor.rowcount:
+                    deleted.add(target_id)
+    instances = [
+        model(user_id=user_id, **{f'{field}_id': target_id})
+        for target_id in deleted
+    ]
+    if instances:
+        change_counters(model, instances, -1)
+        bump_versions(user_version_name(user_id))
+    for instance in instances:
+        post_delete.send(
+            sender=model, instance=instance, using=connection.alias
+        )
+    return deleted
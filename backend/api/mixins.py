@@ -0,0 +1,127 @@
+from collections import defaultdict
+from hashlib import md5
+
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+
+from .cache import get_versions, user_version_name
+from .marks import delete_marks
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы (ETag и Last-Modified) для list и retrieve.
+
+    ETag строится из версий данных в общем кэше, пути с параметрами
+    фильтрации и id пользователя, поэтому ответ 304 не требует ни
+    запросов к БД, ни сериализации.
+    """
+    # Имена версий, от которых зависит ответ
+    etag_versions = ()
+    # Ответ содержит отметки текущего пользователя
+    etag_per_user = False
+
+    def get_etag_versions(self):
+        """Имена версий для текущего запроса."""
+        versions = list(self.etag_versions)
+        if self.etag_per_user and self.request.user.is_authenticated:
+            versions.append(user_version_name(self.request.user.id))
+        return versions
+
+    def get_conditional_state(self, request):
+        """Вернуть ETag и время последнего изменения.
+
+        Прочитанные версии сохраняются в version_snapshot: они получены
+        до запросов к БД и по ним сериализатор проверяет, не изменились
+        ли данные во время ответа.
+        """
+        names = self.get_etag_versions()
+        versions = get_versions(*names)
+        self.version_snapshot = dict(zip(names, versions))
+        user_id = request.user.id if self.etag_per_user else None
+        signature = f'{request.get_full_path()}|{user_id}|{versions}'
+        etag = '"{}"'.format(md5(signature.encode('utf-8')).hexdigest())
+        return etag, max(versions) // 10 ** 9
+
+    def conditional_response(self, view, request, *args, **kwargs):
+        etag, last_modified = self.get_conditional_state(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if self.etag_per_user:
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class ReferenceTableMixin:
+    """Ответы справочника из кэша в памяти процесса.
+
+    Список без параметров отдается заранее отрендеренным JSON,
+    отдельная запись берется из кэша без запроса к БД.
+    """
+    # Справочник из api.reference
+    reference_table = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        return HttpResponse(
+            self.reference_table.render(self.get_serializer_class()),
+            content_type='application/json'
+        )
+
+    def get_object(self):
+        try:
+            pk = int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        obj = self.reference_table.get(pk)
+        if obj is None:
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class MarksAdminMixin:
+    """Удаление отметок пользователей в админке через delete_marks.
+
+    У моделей отметок нет обработчиков post_delete, поэтому
+    QuerySet.delete() не изменил бы счетчики и версии отметок.
+    """
+    # Поле, на которое ссылается отметка
+    mark_field = 'recipe'
+
+    def marks_deleted(self, user_id):
+        """Вызывается после удаления отметок пользователя."""
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        targets = defaultdict(list)
+        for user_id, target_id in queryset.values_list(
+            'user_id', f'{self.mark_field}_id'
+        ):
+            targets[user_id].append(target_id)
+        for user_id, target_ids in targets.items():
+            if delete_marks(self.model, user_id, self.mark_field, target_ids):
+                self.marks_deleted(user_id)
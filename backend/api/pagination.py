@@ -1,5 +1,217 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import partial
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import count_version_name, get_versions
 
 
 class PageNumberLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, кэширующий количество записей.
+
+    Количество хранится по сигнатуре запроса (SQL без сортировки и
+    аннотаций в SELECT) и версиям, от которых зависит результат. По
+    умолчанию это версия модели, которая меняется при создании и
+    удалении записей; version_names задает другой набор, например
+    версию отметок пользователя для списка его избранного. Для
+    PostgreSQL без фильтров при большом объеме таблицы используется
+    оценка планировщика.
+    """
+
+    def __init__(self, *args, version_names=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version_names = version_names
+
+    def get_cache_key(self, queryset):
+        query = queryset.query.chain()
+        query.clear_ordering(force_empty=True)
+        query.set_annotation_mask(())
+        sql, params = query.sql_with_params()
+        signature = md5(f'{sql}{params!r}'.encode('utf-8')).hexdigest()
+        versions = get_versions(
+            *(self.version_names or (count_version_name(queryset.model),))
+        )
+        return f'foodgram:count:{":".join(map(str, versions))}:{signature}'
+
+    def estimate_count(self, queryset):
+        """Оценка количества строк по статистике PostgreSQL."""
+        threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+        connection = connections[queryset.db]
+        if (threshold is None
+                or connection.vendor != 'postgresql'
+                or queryset.query.where
+                or queryset.query.distinct):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] <= threshold:
+            return None
+        return row[0]
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return len(queryset)
+        estimate = self.estimate_count(queryset)
+        if estimate is not None:
+            return estimate
+        try:
+            key = self.get_cache_key(queryset)
+        except EmptyResultSet:
+            return 0
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class CachedCountPagination(PageNumberLimitPagination):
+    """Постраничная пагинация с кэшированным количеством записей.
+
+    Версии количества берутся из метода представления
+    get_count_version_names, если он есть.
+    """
+    django_paginator_class = CachedCountPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        get_version_names = getattr(view, 'get_count_version_names', None)
+        if get_version_names is not None:
+            self.django_paginator_class = partial(
+                CachedCountPaginator, version_names=get_version_names()
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по паре (дата, id) без COUNT и OFFSET.
+
+    Курсор хранит дату и id последней записи страницы, следующая
+    страница выбирается условием по индексу (pub_date, id).
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    position_field = 'pub_date'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        """Размер страницы из параметра limit или из настроек."""
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return PageNumberPagination.page_size
+
+    def decode_cursor(self, request):
+        """Вернуть позицию (дата, id) из курсора или None."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position, pk = urlsafe_b64decode(
+                encoded.encode('ascii')
+            ).decode('ascii').rsplit('|', 1)
+            position = parse_datetime(position)
+            pk = int(pk)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if position is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position, pk
+
+    def encode_cursor(self, instance):
+        """Закодировать позицию записи в курсор."""
+        position = getattr(instance, self.position_field).isoformat()
+        return urlsafe_b64encode(
+            f'{position}|{instance.pk}'.encode('ascii')
+        ).decode('ascii')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(
+            f'-{self.position_field}', '-pk'
+        )
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            position, pk = cursor
+            queryset = queryset.filter(
+                Q(**{f'{self.position_field}__lt': position})
+                | Q(**{self.position_field: position, 'pk__lt': pk})
+            )
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.last_instance = page[-1] if page else None
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            self.encode_cursor(self.last_instance)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class PageNumberOrCursorPagination(CachedCountPagination):
+    """Постраничная пагинация с курсорным режимом по запросу.
+
+    Без параметра cursor работает как CachedCountPagination.
+    Пустой cursor (?cursor=) возвращает первую страницу в курсорном
+    режиме, далее клиент переходит по ссылке next.
+    """
+    cursor_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from recipes.models import (Favorite, PopularityRefresh, RecipePopularity,
+                            ShoppingCart)
+
+from .cache import POPULARITY_VERSION, bump_versions, get_version
+
+# Вклад одного добавления в популярность рецепта
+FAVORITE_WEIGHT: float = 1.0
+SHOPPING_CART_WEIGHT: float = 1.0
+
+# Рецепты с меньшей популярностью удаляются из рейтинга
+MIN_SCORE: float = 0.01
+
+# Количество записей, читаемых одним запросом при пересчете
+BATCH_SIZE: int = 5000
+
+
+def decay(age):
+    """Множитель затухания для промежутка времени age."""
+    half_life = timedelta(hours=settings.POPULARITY_HALF_LIFE_HOURS)
+    return 0.5 ** (age / half_life)
+
+
+def collect_scores(model, watermark, cutoff, now, weight, scores):
+    """Добавить в scores вклад записей model с id больше watermark.
+
+    Учитываются записи, созданные не позже cutoff, чтобы не пропустить
+    строки еще не зафиксированных транзакций с меньшими id.
+    Возвращает новое значение watermark.
+    """
+    rows = model.objects.filter(created__lte=cutoff).order_by('id')
+    while True:
+        batch = list(rows.filter(id__gt=watermark).values_list(
+            'id', 'recipe_id', 'created'
+        )[:BATCH_SIZE])
+        if not batch:
+            return watermark
+        for _, recipe_id, created in batch:
+            scores[recipe_id] += weight * decay(now - created)
+        watermark = batch[-1][0]
+
+
+def add_scores(scores):
+    """Прибавить популярность рецептам: [(id рецепта, прирост)].
+
+    Записи вставляются INSERT ... ON CONFLICT DO UPDATE частями не больше
+    BATCH_SIZE и не больше допустимого в БД числа параметров запроса.
+    """
+    table = RecipePopularity._meta.db_table
+    batch_size = min(
+        BATCH_SIZE,
+        connection.ops.bulk_batch_size(['recipe_id', 'score'], scores)
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(scores), batch_size):
+            batch = scores[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} (recipe_id, score) '
+                f'VALUES {", ".join(["(%s, %s)"] * len(batch))} '
+                'ON CONFLICT (recipe_id) DO UPDATE SET '
+                f'score = {table}.score + EXCLUDED.score',
+                [value for item in batch for value in item]
+            )
+
+
+@transaction.atomic
+def refresh_popularity(lag=None):
+    """Обновить рейтинг по записям, добавленным после прошлого пересчета.
+
+    Накопленная популярность умножается на затухание за время с
+    прошлого пересчета, новые добавления прибавляются через
+    INSERT ... ON CONFLICT DO UPDATE. Удаления из избранного и списков
+    покупок не учитываются. lag — сколько секунд новые записи не
+    учитываются, по умолчанию POPULARITY_REFRESH_LAG. Возвращает
+    количество обновленных рецептов.
+    """
+    if lag is None:
+        lag = settings.POPULARITY_REFRESH_LAG
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=lag)
+    previous = PopularityRefresh.objects.select_for_update().first()
+    if previous is None:
+        previous = PopularityRefresh(
+            refreshed_at=now, favorite_watermark=0, shopping_cart_watermark=0
+        )
+    scores = defaultdict(float)
+    favorite_watermark = collect_scores(
+        Favorite, previous.favorite_watermark, cutoff, now,
+        FAVORITE_WEIGHT, scores
+    )
+    shopping_cart_watermark = collect_scores(
+        ShoppingCart, previous.shopping_cart_watermark, cutoff, now,
+        SHOPPING_CART_WEIGHT, scores
+    )
+    RecipePopularity.objects.update(
+        score=F('score') * decay(now - previous.refreshed_at)
+    )
+    add_scores(list(scores.items()))
+    RecipePopularity.objects.filter(score__lt=MIN_SCORE).delete()
+    # Хранится только последний пересчет
+    PopularityRefresh.objects.exclude(pk=previous.pk).delete()
+    previous.refreshed_at = now
+    previous.favorite_watermark = favorite_watermark
+    previous.shopping_cart_watermark = shopping_cart_watermark
+    previous.save()
+    bump_versions(POPULARITY_VERSION)
+    return len(scores)
+
+
+def get_popular_recipe_ids():
+    """Id самых популярных рецептов из кэша.
+
+    Список хранится до следующего пересчета рейтинга.
+    """
+    key = f'foodgram:popular:{get_version(POPULARITY_VERSION)}'
+    recipe_ids = cache.get(key)
+    if recipe_ids is None:
+        recipe_ids = list(RecipePopularity.objects.order_by(
+            '-score', '-recipe_id'
+        ).values_list(
+            'recipe_id', flat=True
+        )[:settings.POPULAR_RECIPES_LIMIT])
+        cache.set(key, recipe_ids, settings.RECIPE_CACHE_TIMEOUT)
+    return recipe_ids
@@ -0,0 +1,171 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+# Сколько самых частых повторяющихся видов SQL-запросов писать в журнал
+TOP_QUERIES_COUNT: int = 5
+# Списки параметров IN (%s, %s, ...) и числа в тексте запроса
+PARAMETER_LISTS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+NUMBERS = re.compile(r'\b\d+\b')
+
+_profile = ContextVar('request_profile', default=None)
+
+
+def get_query_shape(sql):
+    """Вид запроса: текст без значений параметров и чисел.
+
+    Запросы, отличающиеся только значениями, например в цикле по
+    объектам, получают одинаковый вид.
+    """
+    return NUMBERS.sub('N', PARAMETER_LISTS.sub('(...)', sql))
+
+
+class RequestProfile:
+    """Время и SQL-запросы одного запроса к API."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.view_started = None
+        self.view_finished = None
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.queries = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL для connection.execute_wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries[get_query_shape(sql)] += 1
+
+    def get_timings(self):
+        """Длительности этапов в мс.
+
+        Время SQL и сериализации входит во время представления,
+        запросы из сериализаторов входят и во время сериализации.
+        """
+        view_finished = self.view_finished or self.finished
+        timings = {
+            'total': self.finished - self.started,
+            'db': self.sql_time,
+            'view': (
+                view_finished - self.view_started
+                if self.view_started else 0.0
+            ),
+            'serialize': self.serializer_time,
+            'render': (
+                self.finished - self.view_finished
+                if self.view_finished else 0.0
+            ),
+        }
+        return {name: value * 1000 for name, value in timings.items()}
+
+    def get_repeated_queries(self):
+        """Самые частые виды запросов, выполненные больше одного раза."""
+        return [
+            {'count': count, 'sql': shape}
+            for shape, count in self.queries.most_common(TOP_QUERIES_COUNT)
+            if count > 1
+        ]
+
+
+def profiled_data(data):
+    """Свойство data сериализатора с замером времени сериализации.
+
+    Учитывается только внешний сериализатор, вложенные вызовы не
+    суммируются повторно.
+    """
+    def wrapper(serializer):
+        profile = _profile.get()
+        if profile is None or profile.serializer_depth:
+            return data(serializer)
+        profile.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            profile.serializer_depth -= 1
+            profile.serializer_time += time.perf_counter() - started
+    wrapper.profiled = True
+    return wrapper
+
+
+class RequestProfilingMiddleware:
+    """Замер времени SQL, представления, сериализации и рендеринга.
+
+    Добавляет заголовок Server-Timing и пишет в журнал запросы дольше
+    REQUEST_PROFILING_SLOW_MS вместе с повторяющимися SQL-запросами.
+    Включается настройкой REQUEST_PROFILING, выключенный middleware
+    исключается из цепочки при запуске. Запросы, выполняемые при
+    передаче потокового ответа, не учитываются.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if not getattr(BaseSerializer.data.fget, 'profiled', False):
+            BaseSerializer.data = property(
+                profiled_data(BaseSerializer.data.fget)
+            )
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        profile.finished = time.perf_counter()
+        timings = profile.get_timings()
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.1f}'
+            + (
+                f';desc="{sum(profile.queries.values())} queries"'
+                if name == 'db' else ''
+            )
+            for name, duration in timings.items()
+        )
+        if timings['total'] >= settings.REQUEST_PROFILING_SLOW_MS:
+            logger.warning(json.dumps(
+                {
+                    'event': 'slow_request',
+                    'method': request.method,
+                    'path': request.get_full_path(),
+                    'status': response.status_code,
+                    'timings_ms': {
+                        name: round(duration, 1)
+                        for name, duration in timings.items()
+                    },
+                    'queries': sum(profile.queries.values()),
+                    'repeated_queries': profile.get_repeated_queries(),
+                },
+                ensure_ascii=False
+            ))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _profile.get().view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        """Представление DRF вернуло ответ, дальше идет рендеринг."""
+        _profile.get().view_finished = time.perf_counter()
+        return response
@@ -0,0 +1,75 @@
+import threading
+from collections import namedtuple
+
+from recipes.models import Ingredient, Tag
+from rest_framework.renderers import JSONRenderer
+
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, get_version
+
+ReferenceState = namedtuple(
+    'ReferenceState', ('version', 'objects', 'by_id', 'derived')
+)
+
+
+class ReferenceTable:
+    """Кэш справочной таблицы в памяти процесса.
+
+    Хранит экземпляры модели и заранее отрендеренный JSON. Актуальность
+    проверяется по версии в общем кэше, которая меняется при изменении
+    таблицы, поэтому все процессы gunicorn перечитывают данные после
+    изменений, сделанных в любом из них.
+    """
+
+    def __init__(self, model, version_name):
+        self.model = model
+        self.version_name = version_name
+        self.lock = threading.Lock()
+        self.state = ReferenceState(None, (), {}, {})
+
+    def get_state(self):
+        """Актуальное состояние таблицы, при смене версии перечитать."""
+        version = get_version(self.version_name)
+        state = self.state
+        if state.version == version:
+            return state
+        with self.lock:
+            if self.state.version != version:
+                objects = tuple(self.model.objects.all())
+                self.state = ReferenceState(
+                    version,
+                    objects,
+                    {obj.pk: obj for obj in objects},
+                    {}
+                )
+            return self.state
+
+    def all(self):
+        """Все записи таблицы."""
+        return self.get_state().objects
+
+    def get(self, pk):
+        """Запись по первичному ключу или None."""
+        return self.get_state().by_id.get(pk)
+
+    def derive(self, key, factory):
+        """Построенная по записям таблицы структура.
+
+        Строится один раз для каждой версии таблицы.
+        """
+        state = self.get_state()
+        if key not in state.derived:
+            state.derived[key] = factory(state.objects)
+        return state.derived[key]
+
+    def render(self, serializer_class):
+        """Все записи таблицы в виде JSON."""
+        return self.derive(
+            serializer_class,
+            lambda objects: JSONRenderer().render(
+                serializer_class(objects, many=True).data
+            )
+        )
+
+
+tags = ReferenceTable(Tag, TAGS_VERSION)
+ingredients = ReferenceTable(Ingredient, INGREDIENTS_VERSION)
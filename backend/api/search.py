@@ -0,0 +1,131 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db import connections
+from django.db.models import BooleanField, Case, FloatField, When
+from django.db.models.expressions import RawSQL
+from recipes.models import Recipe
+
+from .autocomplete import normalize
+from .cache import RECIPE_LIST_VERSION
+from .reference import ReferenceTable
+
+# Вес совпадения в названии и в описании рецепта
+NAME_WEIGHT: int = 2
+TEXT_WEIGHT: int = 1
+
+# Выражение совпадает с индексом recipe_search_vector_idx
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', "
+    "coalesce(\"recipes_recipe\".\"name\", '')), 'A') || "
+    "setweight(to_tsvector('russian', "
+    "coalesce(\"recipes_recipe\".\"text\", '')), 'B')"
+)
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """Слова нормализованного текста."""
+    return TOKEN_RE.findall(normalize(text))
+
+
+def search_postgresql(queryset, value):
+    """Полнотекстовый поиск и поиск по сходству названия в PostgreSQL.
+
+    Каждое слово запроса ищется как префикс, поэтому поиск работает
+    и по недописанным словам.
+    """
+    tokens = tokenize(value)
+    if not tokens:
+        return queryset.none()
+    ts_query = ' & '.join(f'{token}:*' for token in tokens)
+    return queryset.filter(
+        RawSQL(
+            f"({SEARCH_VECTOR_SQL}) @@ to_tsquery('russian', %s) "
+            'OR "recipes_recipe"."name" %% %s',
+            (ts_query, value),
+            output_field=BooleanField()
+        )
+    ).annotate(
+        search_rank=RawSQL(
+            f"ts_rank({SEARCH_VECTOR_SQL}, to_tsquery('russian', %s)) "
+            '+ similarity("recipes_recipe"."name", %s)',
+            (ts_query, value),
+            output_field=FloatField()
+        )
+    ).order_by('-search_rank', '-pub_date', '-id')
+
+
+class InvertedIndex:
+    """Обратный индекс слов названий и описаний рецептов."""
+
+    def __init__(self, recipes):
+        postings = defaultdict(dict)
+        for recipe in recipes:
+            for weight, text in (
+                (NAME_WEIGHT, recipe.name), (TEXT_WEIGHT, recipe.text)
+            ):
+                for token in tokenize(text):
+                    scores = postings[token]
+                    scores[recipe.id] = max(scores.get(recipe.id, 0), weight)
+        self.tokens = sorted(postings)
+        self.postings = postings
+
+    def search(self, value):
+        """Id рецептов, содержащих все слова запроса, по релевантности."""
+        scores = None
+        for query_token in tokenize(value):
+            token_scores = defaultdict(int)
+            start = bisect_left(self.tokens, query_token)
+            for index in range(start, len(self.tokens)):
+                token = self.tokens[index]
+                if not token.startswith(query_token):
+                    break
+                for recipe_id, weight in self.postings[token].items():
+                    token_scores[recipe_id] = max(
+                        token_scores[recipe_id], weight
+                    )
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    recipe_id: score + token_scores[recipe_id]
+                    for recipe_id, score in scores.items()
+                    if recipe_id in token_scores
+                }
+        if not scores:
+            return []
+        return sorted(scores, key=lambda recipe_id: -scores[recipe_id])
+
+
+recipes = ReferenceTable(Recipe, RECIPE_LIST_VERSION)
+
+
+def search_fallback(queryset, value):
+    """Поиск по обратному индексу в памяти процесса."""
+    recipe_ids = recipes.derive(InvertedIndex, InvertedIndex).search(value)
+    if not recipe_ids:
+        return queryset.none()
+    return queryset.filter(id__in=recipe_ids).order_by(
+        Case(
+            *(
+                When(id=recipe_id, then=position)
+                for position, recipe_id in enumerate(recipe_ids)
+            )
+        ),
+        '-pub_date',
+        '-id'
+    )
+
+
+def search_recipes(queryset, value):
+    """Найти рецепты по названию и описанию с сортировкой по релевантности.
+
+    В PostgreSQL используются полнотекстовый поиск и pg_trgm, в
+    остальных СУБД обратный индекс в памяти процесса.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        return search_postgresql(queryset, value)
+    return search_fallback(queryset, value)
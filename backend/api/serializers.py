@@ -1,15 +1,83 @@
+from collections import Counter, OrderedDict
+
+from django.conf import settings as django_settings
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from djoser.conf import settings
 from djoser.serializers import UserSerializer
-from drf_extra_fields.fields import Base64ImageField
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, Tag)
 from rest_framework import serializers
 from users.models import Follow
 
+from . import reference
+from .cache import get_recipe_payload_keys
+from .fields import Base64ImageFileField, stored_upload
+from .images import get_image_url, get_image_urls, variants_ready
+from .shopping_list import change_recipe
+
 User = get_user_model()
 
+# Наибольшее число рецептов в одном массовом запросе
+RECIPE_IDS_MAX_LENGTH: int = 100
+
+# Связанные данные, необходимые для сериализации рецепта
+RECIPE_PREFETCH = (
+    'tags',
+    'ingredientrecipe_set',
+)
+
+
+def build_absolute_uri(request, url):
+    """Абсолютный URL файла или None."""
+    return request.build_absolute_uri(url) if url else None
+
+
+def check_reference_ids(ids, known, name):
+    """Сообщить сразу обо всех отсутствующих и повторяющихся id."""
+    errors = []
+    missing = sorted({value for value in ids if value not in known})
+    if missing:
+        errors.append(
+            f'{name} не найдены: {", ".join(map(str, missing))}.'
+        )
+    duplicates = sorted(
+        value for value, count in Counter(ids).items() if count > 1
+    )
+    if duplicates:
+        errors.append(
+            f'{name} повторяются: {", ".join(map(str, duplicates))}.'
+        )
+    if errors:
+        raise serializers.ValidationError(errors)
+
+
+def get_reference(context, table):
+    """Состояние справочника, одно на всю сериализацию."""
+    key = f'reference:{table.version_name}'
+    if key not in context:
+        context[key] = table.get_state()
+    return context[key]
+
+
+def get_following_ids(request):
+    """Id авторов, на которых подписан текущий пользователь.
+
+    Загружаются одним запросом и сохраняются в запросе, чтобы все
+    вложенные сериализаторы использовали один и тот же набор.
+    """
+    if request is None or not request.user.is_authenticated:
+        return frozenset()
+    following_ids = getattr(request, '_following_ids', None)
+    if following_ids is None:
+        following_ids = frozenset(
+            request.user.subscriptions.values_list('following_id', flat=True)
+        )
+        request._following_ids = following_ids
+    return following_ids
+
 
 class CustomUserSerializer(UserSerializer):
     """Сериализатор для пользователя."""
@@ -25,11 +93,7 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         """Подписан ли текущий пользователь на этого."""
-        user = self.context['request'].user
-        return (
-            user.is_authenticated
-            and user.subscriptions.filter(following=obj).exists()
-        )
+        return obj.id in get_following_ids(self.context.get('request'))
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -57,9 +121,15 @@ class IdIngredientField(serializers.Field):
         return value
 
     def to_internal_value(self, data):
-        """Проверить наличие ингредиента и вернуть id."""
-        get_object_or_404(Ingredient, id=data)
-        return data
+        """Вернуть id ингредиента.
+
+        Наличие в справочнике проверяется сразу для всего списка
+        в RecipeWriteSerializer.validate_ingredients.
+        """
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError('Некорректный id ингредиента.')
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -74,9 +144,53 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
         model = IngredientRecipe
 
+    def to_representation(self, instance):
+        """Название и единица измерения берутся из справочника."""
+        ingredient = get_reference(
+            self.context, reference.ingredients
+        ).by_id.get(instance.ingredient_id)
+        if ingredient is None:
+            ingredient = instance.ingredient
+        return OrderedDict((
+            ('id', ingredient.id),
+            ('name', ingredient.name),
+            ('measurement_unit', ingredient.measurement_unit),
+            ('amount', instance.amount),
+        ))
+
+
+class TagField(serializers.PrimaryKeyRelatedField):
+    """Id тега.
+
+    Наличие в справочнике проверяется сразу для всего списка
+    в RecipeWriteSerializer.validate_tags.
+    """
+
+    def to_internal_value(self, data):
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов с общей выборкой данных из кэша."""
+
+    def to_representation(self, data):
+        recipes = list(
+            data.all() if isinstance(data, models.Manager) else data
+        )
+        self.child.load_cached_payloads(recipes)
+        return super().to_representation(recipes)
+
 
 class RecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор модели рецептов."""
+    """Сериализатор модели рецептов.
+
+    Не зависящая от пользователя часть данных рецепта кэшируется по id
+    и версии рецепта, отметки избранного, списка покупок и подписки на
+    автора добавляются при каждом запросе.
+    """
     tags = TagSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientRecipeSerializer(
@@ -84,7 +198,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
-    image = Base64ImageField(max_length=None, use_url=True)
+    image = Base64ImageFileField(max_length=None, use_url=True)
+    images = serializers.SerializerMethodField()
 
     class Meta:
         fields = (
@@ -94,6 +209,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
             'is_favorited',
@@ -101,9 +217,79 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
         model = Recipe
         read_only_fields = ('id',)
+        list_serializer_class = RecipeListSerializer
+
+    def load_cached_payloads(self, recipes):
+        """Получить данные рецептов из кэша, для остальных загрузить
+        связанные объекты.
+
+        Загруженные данные кэшируются, только если версии, прочитанные
+        представлением до запросов к БД (view.version_snapshot), не
+        изменились.
+        """
+        self.payload_keys, self.payloads_writable = get_recipe_payload_keys(
+            [recipe.id for recipe in recipes],
+            getattr(self.context.get('view'), 'version_snapshot', None)
+        )
+        cached = cache.get_many(self.payload_keys.values())
+        self.cached_payloads = {
+            recipe_id: cached[key]
+            for recipe_id, key in self.payload_keys.items()
+            if key in cached
+        }
+        prefetch_related_objects(
+            [
+                recipe for recipe in recipes
+                if recipe.id not in self.cached_payloads
+            ],
+            *RECIPE_PREFETCH
+        )
+
+    def to_representation(self, instance):
+        """Данные рецепта из кэша с отметками текущего пользователя."""
+        if instance.id not in getattr(self, 'payload_keys', {}):
+            self.load_cached_payloads([instance])
+        payload = self.cached_payloads.pop(instance.id, None)
+        if payload is None:
+            payload = super().to_representation(instance)
+            payload.pop('is_favorited')
+            payload.pop('is_in_shopping_cart')
+            payload['author'].pop('is_subscribed')
+            payload['image'] = get_image_url(instance, 'full')
+            # До готовности вариантов отдается оригинал без кэширования
+            if self.payloads_writable and variants_ready(instance):
+                cache.set(
+                    self.payload_keys[instance.id],
+                    payload,
+                    django_settings.RECIPE_CACHE_TIMEOUT
+                )
+        request = self.context.get('request')
+        if request is not None:
+            payload['image'] = build_absolute_uri(request, payload['image'])
+            payload['images'] = {
+                variant: {
+                    extension: build_absolute_uri(request, url)
+                    for extension, url in urls.items()
+                }
+                for variant, urls in payload['images'].items()
+            }
+        payload['author']['is_subscribed'] = (
+            instance.author_id in get_following_ids(request)
+        )
+        payload['is_favorited'] = self.get_is_favorited(instance)
+        payload['is_in_shopping_cart'] = self.get_is_in_shopping_cart(
+            instance
+        )
+        return payload
+
+    def get_images(self, obj):
+        """URL уменьшенных копий изображения по размерам и форматам."""
+        return get_image_urls(obj)
 
     def get_is_favorited(self, obj):
         """Находится ли рецепт в списке избранного."""
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         return (
             user.is_authenticated
@@ -114,6 +300,8 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, obj):
         """Находится ли рецепт в списке покупок."""
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         return (
             user.is_authenticated
@@ -125,56 +313,113 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 class RecipeWriteSerializer(RecipeSerializer):
     """Сериализатор для создания и изменения рецепта."""
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = TagField(
         many=True,
         queryset=Tag.objects.all()
     )
 
-    @transaction.atomic
+    def validate_tags(self, value):
+        """Проверить все id тегов по справочнику."""
+        check_reference_ids(
+            value, get_reference(self.context, reference.tags).by_id, 'Теги'
+        )
+        return value
+
+    def validate_ingredients(self, value):
+        """Проверить все id ингредиентов по справочнику."""
+        check_reference_ids(
+            [item['ingredient']['id'] for item in value],
+            get_reference(self.context, reference.ingredients).by_id,
+            'Ингредиенты'
+        )
+        return value
+
     def create(self, validated_data):
-        """Создание рецепта."""
-        ingredients_recipe = validated_data.pop('ingredientrecipe_set')
+        """Создание рецепта.
+
+        Файл изображения сохраняется в хранилище до начала транзакции.
+        """
+        with stored_upload(validated_data, Recipe._meta.get_field('image')):
+            return self.create_recipe(validated_data)
+
+    @transaction.atomic
+    def create_recipe(self, validated_data):
+        ingredients_data = validated_data.pop('ingredientrecipe_set')
         tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
-        recipe.tags.set(tags)
-        ingredients_amount = []
-        for ingredient_recipe in ingredients_recipe:
-            id = ingredient_recipe['ingredient'].get('id')
-            ingredients_amount.append(
-                IngredientRecipe(
-                    recipe=recipe,
-                    ingredient=Ingredient.objects.get(id=id),
-                    amount=ingredient_recipe.get('amount')
-                )
+        recipe.tags.add(*tags)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient['ingredient']['id'],
+                amount=ingredient['amount']
             )
-        IngredientRecipe.objects.bulk_create(ingredients_amount)
+            for ingredient in ingredients_data
+        )
         return recipe
 
-    @transaction.atomic
     def update(self, instance, validated_data):
-        """Обновление рецепта."""
-        tags = validated_data.pop('tags')
-        ingredients_data = validated_data.pop('ingredientrecipe_set')
+        """Обновление рецепта.
+
+        Файл изображения сохраняется в хранилище до начала транзакции.
+        """
+        with stored_upload(validated_data, Recipe._meta.get_field('image')):
+            return self.update_recipe(instance, validated_data)
+
+    @transaction.atomic
+    def update_recipe(self, instance, validated_data):
+        """Изменить рецепт, записав только изменившиеся теги и ингредиенты."""
+        tags = set(validated_data.pop('tags'))
+        new_amounts = {
+            ingredient['ingredient']['id']: ingredient['amount']
+            for ingredient in validated_data.pop('ingredientrecipe_set')
+        }
         instance = super().update(instance, validated_data)
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        ingredients_amount = []
-        for ingredient in ingredients_data:
-            id = ingredient['ingredient'].get('id')
-            current_ingredient = get_object_or_404(
-                Ingredient,
-                id=id
-            )
-            ingredients_amount.append(
-                IngredientRecipe(
-                    recipe=instance,
-                    ingredient=current_ingredient,
-                    amount=ingredient.get('amount')
-                )
-            )
-        IngredientRecipe.objects.bulk_create(ingredients_amount)
+        old_tags = set(
+            instance.tags.through.objects.filter(
+                recipe_id=instance.id
+            ).values_list('tag_id', flat=True)
+        )
+        if old_tags - tags:
+            instance.tags.remove(*(old_tags - tags))
+        if tags - old_tags:
+            instance.tags.add(*(tags - old_tags))
+        self.update_ingredients(instance, new_amounts)
         return instance
 
+    def update_ingredients(self, instance, new_amounts):
+        """Применить к ингредиентам рецепта только изменения."""
+        rows = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in IngredientRecipe.objects.filter(
+                recipe_id=instance.id
+            ).values_list('id', 'ingredient_id', 'amount')
+        }
+        old_amounts = {
+            ingredient_id: amount
+            for ingredient_id, (_, amount) in rows.items()
+        }
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            IngredientRecipe.objects.filter(
+                id__in=[rows[ingredient_id][0] for ingredient_id in removed]
+            ).delete()
+        changed = [
+            IngredientRecipe(id=rows[ingredient_id][0], amount=amount)
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id in rows and old_amounts[ingredient_id] != amount
+        ]
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in rows
+        )
+        change_recipe(instance.id, old_amounts, new_amounts)
+
     def to_representation(self, instance):
         """Для показа данных о новом рецепте."""
         return RecipeSerializer(
@@ -186,6 +431,7 @@ class RecipeWriteSerializer(RecipeSerializer):
 
 
 class RecipeReducedSerializer(serializers.ModelSerializer):
+    image = serializers.SerializerMethodField()
 
     class Meta:
         fields = (
@@ -196,6 +442,48 @@ class RecipeReducedSerializer(serializers.ModelSerializer):
         )
         model = Recipe
 
+    def get_image(self, obj):
+        """Миниатюра изображения рецепта."""
+        url = get_image_url(obj, 'thumbnail')
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return build_absolute_uri(request, url)
+
+
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Сериализатор суммарного количества ингредиента в списке покупок."""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+    amount = serializers.ReadOnlyField(source='total_amount')
+
+    class Meta:
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+        model = ShoppingListItem
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массовых операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=RECIPE_IDS_MAX_LENGTH
+    )
+
+
+class FollowListSerializer(serializers.ListSerializer):
+    """Список подписок с рецептами авторов, загруженными разом."""
+
+    def to_representation(self, data):
+        follows = list(
+            data.all() if isinstance(data, models.Manager) else data
+        )
+        self.child.load_recipe_previews(follows)
+        return super().to_representation(follows)
+
 
 class FollowSerializer(serializers.ModelSerializer):
     """Сериализатор модели Follow."""
@@ -206,7 +494,9 @@ class FollowSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='following.last_name')
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.ReadOnlyField(
+        source='following.recipes_count'
+    )
 
     class Meta:
         fields = (
@@ -220,6 +510,7 @@ class FollowSerializer(serializers.ModelSerializer):
             'recipes_count'
         )
         model = Follow
+        list_serializer_class = FollowListSerializer
         read_only_fields = (
             'email',
             'id',
@@ -232,21 +523,57 @@ class FollowSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        return self.context['request'].user.subscriptions.filter(
-            following=obj.following
-        ).exists()
+        """Подписка всегда принадлежит текущему пользователю."""
+        return obj.user_id == self.context['request'].user.id
 
-    def get_recipes_count(self, obj):
-        return obj.following.recipes.count()
+    def get_recipes_limit(self):
+        """Число рецептов каждого автора из параметра recipes_limit.
 
-    def get_recipes(self, obj):
+        При 0 рецепты не выводятся, без параметра или при
+        некорректном значении выводятся все.
+        """
         request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.following.recipes.all()
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        try:
+            recipes_limit = int(request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit >= 0 else None
+
+    def load_recipe_previews(self, follows):
+        """Загрузить последние рецепты всех авторов одним запросом.
+
+        Рецепты нумеруются оконной функцией ROW_NUMBER() отдельно
+        для каждого автора, лишние отсекаются в БД.
+        """
+        author_ids = [follow.following_id for follow in follows]
+        self.recipe_previews = {author_id: [] for author_id in author_ids}
+        recipes_limit = self.get_recipes_limit()
+        if not author_ids or recipes_limit == 0:
+            return
+        sql = (
+            'SELECT * FROM ('
+            'SELECT id, author_id, name, image, image_variants, '
+            'cooking_time, '
+            'ROW_NUMBER() OVER ('
+            'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+            ') AS preview_number '
+            f'FROM {Recipe._meta.db_table} '
+            f'WHERE author_id IN ({", ".join(["%s"] * len(author_ids))})'
+            ') AS previews'
+        )
+        params = list(author_ids)
+        if recipes_limit is not None:
+            sql += ' WHERE preview_number <= %s'
+            params.append(recipes_limit)
+        sql += ' ORDER BY author_id, preview_number'
+        for recipe in Recipe.objects.raw(sql, params):
+            self.recipe_previews[recipe.author_id].append(recipe)
+
+    def get_recipes(self, obj):
+        if obj.following_id not in getattr(self, 'recipe_previews', {}):
+            self.load_recipe_previews([obj])
         serializer = RecipeReducedSerializer(
-            recipes,
+            self.recipe_previews[obj.following_id],
             many=True,
             read_only=True
         )
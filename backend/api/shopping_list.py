@@ -0,0 +1,283 @@
+import csv
+import json
+from collections import Counter
+from datetime import date
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import (Case, F, IntegerField, OuterRef, Subquery, Sum,
+                              Value, When)
+from django.http import HttpResponse, StreamingHttpResponse
+from recipes.models import IngredientRecipe, ShoppingCart, ShoppingListItem
+
+# Ширина разделителя в текстовом списке покупок
+SEPARATOR_LENGTH: int = 30
+FOOTER = 'Foodgram. Продуктовый помощник'
+
+
+def calculate_shopping_lists(users=None):
+    """Суммы ингредиентов по рецептам из списков покупок.
+
+    Источник истины для таблицы ShoppingListItem: группировка
+    выполняется в БД по пользователю и ингредиенту.
+    """
+    queryset = ShoppingCart.objects.all()
+    if users is not None:
+        queryset = queryset.filter(user__in=users)
+    return queryset.values(
+        'user_id', 'recipe__ingredientrecipe__ingredient_id'
+    ).annotate(
+        total_amount=Sum('recipe__ingredientrecipe__amount')
+    ).filter(
+        total_amount__gt=0
+    ).order_by().values_list(
+        'user_id',
+        'recipe__ingredientrecipe__ingredient_id',
+        'total_amount'
+    )
+
+
+def get_recipe_amounts(recipe_id):
+    """Количество каждого ингредиента рецепта."""
+    return Counter(dict(
+        IngredientRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    ))
+
+
+def apply_deltas(user_ids, deltas):
+    """Изменить суммы ингредиентов в списках покупок пользователей.
+
+    Увеличение выполняется одним INSERT ... ON CONFLICT DO UPDATE,
+    уменьшение одним UPDATE, после чего удаляются пустые строки.
+    Вызывается внутри транзакции изменения списка покупок или рецепта.
+    """
+    user_ids = list(user_ids)
+    increments = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta > 0
+    }
+    decrements = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta < 0
+    }
+    if not user_ids:
+        return
+    if increments:
+        table = ShoppingListItem._meta.db_table
+        rows = [
+            (user_id, ingredient_id, delta)
+            for user_id in user_ids
+            for ingredient_id, delta in increments.items()
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, total_amount) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(rows))} '
+                'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+                f'total_amount = {table}.total_amount '
+                '+ EXCLUDED.total_amount',
+                [value for row in rows for value in row]
+            )
+    if decrements:
+        items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+        items.filter(ingredient_id__in=decrements).update(
+            total_amount=F('total_amount') + Case(
+                *(
+                    When(ingredient_id=ingredient_id, then=Value(delta))
+                    for ingredient_id, delta in decrements.items()
+                ),
+                output_field=IntegerField()
+            )
+        )
+        items.filter(total_amount__lte=0).delete()
+
+
+def add_recipe(user_id, recipe_id):
+    """Учесть добавление рецепта в список покупок одним запросом."""
+    table = ShoppingListItem._meta.db_table
+    source = IngredientRecipe._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, ingredient_id, total_amount) '
+            f'SELECT %s, ingredient_id, amount FROM {source} '
+            'WHERE recipe_id = %s AND amount > 0 '
+            'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+            f'total_amount = {table}.total_amount + EXCLUDED.total_amount',
+            [user_id, recipe_id]
+        )
+
+
+def remove_recipe(user_id, recipe_id):
+    """Учесть удаление рецепта из списка покупок."""
+    recipe_ingredients = IngredientRecipe.objects.filter(recipe_id=recipe_id)
+    items = ShoppingListItem.objects.filter(user_id=user_id)
+    items.filter(
+        ingredient_id__in=recipe_ingredients.values('ingredient_id')
+    ).update(
+        total_amount=F('total_amount') - Subquery(
+            recipe_ingredients.filter(
+                ingredient_id=OuterRef('ingredient_id')
+            ).values('amount')[:1]
+        )
+    )
+    items.filter(total_amount__lte=0).delete()
+
+
+def change_recipe(recipe_id, old_amounts, new_amounts):
+    """Учесть изменение ингредиентов рецепта во всех списках покупок."""
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if deltas:
+        apply_deltas(
+            ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True),
+            deltas
+        )
+
+
+def rebuild_shopping_list(user_id):
+    """Пересчитать список покупок пользователя по рецептам в корзине.
+
+    Используется после массовых изменений корзины, для которых
+    неизвестно, какие именно строки были вставлены.
+    """
+    ShoppingListItem.objects.filter(user_id=user_id).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            total_amount=total_amount
+        )
+        for user_id, ingredient_id, total_amount
+        in calculate_shopping_lists([user_id])
+    )
+
+
+def get_shopping_list(user):
+    """Суммарное количество ингредиентов из списка покупок пользователя.
+
+    Читается из таблицы ShoppingListItem, одинаковые ингредиенты
+    с разными единицами измерения не объединяются.
+    """
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'total_amount'
+    )
+
+
+def get_title(user):
+    return f'Список покупок пользователя: {user.first_name} {user.last_name}'
+
+
+def render_txt(user, items):
+    yield f'{get_title(user)}\n'
+    yield f'Дата: {date.today()}\n'
+    yield '-' * SEPARATOR_LENGTH + '\n'
+    for number, (name, measurement_unit, amount) in enumerate(items, 1):
+        yield f'{number}. {name} - {amount} {measurement_unit}\n'
+    yield '-' * SEPARATOR_LENGTH + '\n'
+    yield FOOTER
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(user, items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for item in items:
+        yield writer.writerow(item)
+
+
+def render_json(user, items):
+    yield '{"date": %s, "ingredients": [' % json.dumps(str(date.today()))
+    separator = ''
+    for name, measurement_unit, amount in items:
+        yield separator + json.dumps(
+            {
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount
+            },
+            ensure_ascii=False
+        )
+        separator = ', '
+    yield ']}'
+
+
+def render_pdf(user, items):
+    """Список покупок в PDF.
+
+    reportlab формирует документ целиком, поэтому PDF не передается
+    потоком.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    font = 'Helvetica'
+    if Path(settings.SHOPPING_LIST_PDF_FONT).is_file():
+        font = 'ShoppingListFont'
+        pdfmetrics.registerFont(
+            TTFont(font, settings.SHOPPING_LIST_PDF_FONT)
+        )
+    buffer = BytesIO()
+    document = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin, line_height = 50, 18
+    position = height - margin
+    for line in render_txt(user, items):
+        if position < margin:
+            document.showPage()
+            position = height - margin
+        document.setFont(font, 12)
+        document.drawString(margin, position, line.rstrip('\n'))
+        position -= line_height
+    document.save()
+    return buffer.getvalue()
+
+
+def shopping_list_response(user, file_format):
+    """Ответ с файлом списка покупок в запрошенном формате."""
+    items = get_shopping_list(user).iterator()
+    content_type = {
+        'txt': 'text/plain',
+        'csv': 'text/csv',
+        'json': 'application/json',
+        'pdf': 'application/pdf',
+    }[file_format]
+    if file_format == 'pdf':
+        response = HttpResponse(
+            render_pdf(user, items), content_type=content_type
+        )
+    else:
+        renderer = {
+            'txt': render_txt,
+            'csv': render_csv,
+            'json': render_json,
+        }[file_format]
+        response = StreamingHttpResponse(
+            renderer(user, items),
+            content_type=f'{content_type}; charset=utf-8'
+        )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_list.{file_format}"'
+    )
+    return response
@@ -0,0 +1,201 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Follow
+
+from . import feed, images
+from .cache import (INGREDIENTS_VERSION, TAGS_VERSION, bump_versions,
+                    count_version_name, invalidate_all_recipes,
+                    invalidate_recipes, user_version_name)
+from .counters import change_counters
+
+User = get_user_model()
+
+# Модели, от которых зависит количество записей в постраничных списках.
+# Избранное и список покупок меняют только количество в списках с
+# фильтром по отметкам пользователя, оно зависит от версии его отметок
+COUNT_DEPENDENCIES = {
+    Recipe: (Recipe,),
+    User: (User,),
+    Follow: (Follow,),
+}
+
+
+def bump_count_versions(sender):
+    bump_versions(*(
+        count_version_name(model) for model in COUNT_DEPENDENCIES[sender]
+    ))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Follow)
+def count_on_create(sender, created, **kwargs):
+    """Сбросить кэш количества при создании записи."""
+    if created:
+        bump_count_versions(sender)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Follow)
+def count_on_delete(sender, **kwargs):
+    """Сбросить кэш количества при удалении записи."""
+    bump_count_versions(sender)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def counters_on_create(sender, instance, created, raw, **kwargs):
+    """Увеличить денормализованные счетчики в той же транзакции."""
+    if created and not raw:
+        change_counters(sender, [instance], 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def counters_on_delete(sender, instance, **kwargs):
+    """Уменьшить счетчик рецептов автора в той же транзакции.
+
+    Счетчики отметок уменьшает delete_marks: обработчики post_delete
+    отметок отключают быстрое удаление, и при удалении рецепта
+    каскадное удаление каждой отметки обновляло бы сам рецепт.
+    """
+    change_counters(sender, [instance], -1)
+
+
+@receiver(pre_delete, sender=User)
+def user_marks_deleting(sender, instance, **kwargs):
+    """Учесть отметки пользователя, удаляемые вместе с ним.
+
+    Каскадное удаление отметок не отправляет сигналов, поэтому
+    счетчики рецептов и авторов уменьшаются заранее, а подписчикам
+    удаляемого пользователя меняется версия отметок.
+    """
+    for model, field in (
+        (Favorite, 'recipe'), (ShoppingCart, 'recipe'), (Follow, 'following')
+    ):
+        change_counters(
+            model, list(model.objects.filter(user=instance).only(field)), -1
+        )
+    bump_versions(*(
+        user_version_name(user_id)
+        for user_id in Follow.objects.filter(
+            following=instance
+        ).values_list('user_id', flat=True)
+    ))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def count_on_tags_change(sender, action, **kwargs):
+    """Сбросить кэш количества рецептов при смене тегов."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_count_versions(Recipe)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    """Сбросить кэш данных рецепта при его изменении."""
+    invalidate_recipes(instance.id)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Сбросить кэш данных рецепта при изменении его ингредиентов.
+
+    Удаление ингредиентов рецепта сопровождается сохранением рецепта,
+    обработчик post_delete замедлил бы каскадное удаление рецепта.
+    """
+    invalidate_recipes(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=IngredientRecipe)
+def recipe_relations_changed(sender, instance, action, reverse, **kwargs):
+    """Сбросить кэш данных рецептов при изменении тегов и ингредиентов."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_recipes(instance.id)
+    elif kwargs['pk_set']:
+        invalidate_recipes(*kwargs['pk_set'])
+    else:
+        invalidate_all_recipes()
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    """Сбросить кэш данных рецептов автора при изменении его профиля."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    invalidate_recipes(*instance.recipes.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    """Сменить версию тегов и сбросить кэш данных всех рецептов."""
+    bump_versions(TAGS_VERSION)
+    invalidate_all_recipes()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    """Сменить версию ингредиентов и сбросить кэш данных всех рецептов."""
+    bump_versions(INGREDIENTS_VERSION)
+    invalidate_all_recipes()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def user_marks_changed(sender, instance, **kwargs):
+    """Сменить версию отметок пользователя.
+
+    При удалении отметок версию меняет delete_marks.
+    """
+    bump_versions(user_version_name(instance.user_id))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, raw, **kwargs):
+    """Разослать новый рецепт по лентам после фиксации транзакции."""
+    if created and not raw:
+        transaction.on_commit(partial(feed.fan_out_recipe, instance.id))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, raw, **kwargs):
+    """Создать варианты нового изображения после фиксации транзакции."""
+    if raw or not instance.image:
+        return
+    if instance.image.name != instance.image_variants.get('source'):
+        transaction.on_commit(partial(
+            images.schedule_variants, instance.id, instance.image.name
+        ))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw, **kwargs):
+    """Добавить рецепты автора в ленту подписчика."""
+    if created and not raw:
+        transaction.on_commit(partial(
+            feed.backfill_follow, instance.user_id, instance.following_id
+        ))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Убрать рецепты автора из ленты бывшего подписчика."""
+    transaction.on_commit(partial(
+        feed.trim_follow, instance.user_id, instance.following_id
+    ))
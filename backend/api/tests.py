@@ -0,0 +1,654 @@
+import json
+import tempfile
+import threading
+from base64 import b64encode
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APITestCase
+from users.models import Follow
+
+from . import catalog, feed, reference
+from .fields import Base64ImageFileField
+from .search import search_fallback
+from .shopping_list import calculate_shopping_lists
+
+User = get_user_model()
+
+# Отдельный кэш процесса тестов вместо общего кэша развертывания
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'foodgram-tests',
+    }
+}
+
+# Запросы точки сохранения: в TestCase atomic представления не начинает
+# транзакцию, а создает и освобождает точку сохранения
+SAVEPOINT_QUERIES: int = 2
+# Количество одновременных одинаковых запросов
+THREADS_COUNT: int = 8
+# Сколько раз повторяется добавление и удаление каждой отметки
+ROUNDS_COUNT: int = 3
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@foodgram.ru',
+        username=name,
+        first_name=name,
+        last_name=name,
+        password=f'{name}-password'
+    )
+
+
+def create_recipe(author, name='recipe', ingredients=()):
+    """Рецепт без обработки изображения: совпадающий source отключает
+    создание вариантов."""
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        image=f'recipes/{name}.png',
+        image_variants={'source': f'recipes/{name}.png'},
+        text=name,
+        cooking_time=1
+    )
+    IngredientRecipe.objects.bulk_create(
+        IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+        for ingredient in ingredients
+    )
+    return recipe
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConcurrentMarksTests(TransactionTestCase):
+    """Одновременные одинаковые запросы на добавление и удаление отметок.
+
+    Запросы из потоков идут через отдельные соединения, поэтому данные
+    фиксируются в тестовой БД.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('user')
+        self.author = create_user('author')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient{index}', measurement_unit='г')
+            for index in range(3)
+        )
+        self.recipe = create_recipe(
+            self.author, ingredients=Ingredient.objects.all()
+        )
+
+    def send_concurrently(self, method, url, data=None):
+        """Отправить одинаковые запросы из потоков одновременно.
+
+        Возвращает количество ответов по статусам HTTP и, для массовых
+        запросов, по статусам id в ответе.
+        """
+        barrier = threading.Barrier(THREADS_COUNT)
+
+        def send(_):
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                response = getattr(client, method)(url, data, format='json')
+            finally:
+                connection.close()
+            if data is None or response.status_code != 200:
+                return response.status_code, []
+            return response.status_code, [
+                result['status'] for result in response.data['results']
+            ]
+
+        statuses, results = Counter(), Counter()
+        with ThreadPoolExecutor(THREADS_COUNT) as executor:
+            for status, items in executor.map(send, range(THREADS_COUNT)):
+                statuses[status] += 1
+                results.update(items)
+        return statuses, results
+
+    def assert_state(self, model, expected):
+        """Сравнить отметки, счетчики и список покупок с ожидаемыми."""
+        if model is Follow:
+            rows = Follow.objects.filter(
+                user=self.user, following=self.author
+            )
+        else:
+            rows = model.objects.filter(user=self.user, recipe=self.recipe)
+        self.assertEqual(rows.count(), expected)
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            self.recipe.favorites_count,
+            Favorite.objects.filter(recipe=self.recipe).count()
+        )
+        self.assertEqual(
+            self.recipe.shopping_carts_count,
+            ShoppingCart.objects.filter(recipe=self.recipe).count()
+        )
+        self.assertEqual(
+            self.author.followers_count,
+            Follow.objects.filter(following=self.author).count()
+        )
+        self.assertEqual(
+            set(ShoppingListItem.objects.filter(user=self.user).values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )),
+            set(calculate_shopping_lists([self.user.id]))
+        )
+
+    def test_toggles(self):
+        recipe_url = f'/api/recipes/{self.recipe.id}'
+        toggles = (
+            ('favorite', Favorite, f'{recipe_url}/favorite/'),
+            ('shopping-cart', ShoppingCart, f'{recipe_url}/shopping_cart/'),
+            ('subscribe', Follow, f'/api/users/{self.author.id}/subscribe/'),
+        )
+        steps = (
+            ('add', 'post', 201, 1),
+            ('remove', 'delete', 204, 0),
+        )
+        for name, model, url in toggles:
+            for number in range(ROUNDS_COUNT):
+                for step, method, success, expected in steps:
+                    with self.subTest(f'{name}-{step} #{number + 1}'):
+                        statuses, _ = self.send_concurrently(method, url)
+                        self.assertEqual(
+                            statuses,
+                            Counter({success: 1, 400: THREADS_COUNT - 1})
+                        )
+                        self.assert_state(model, expected)
+
+    def test_bulk(self):
+        """Массовые отметки: рецепт добавляется и удаляется один раз."""
+        bulk = (
+            ('favorite-bulk', Favorite, '/api/recipes/favorite/'),
+            (
+                'shopping-cart-bulk',
+                ShoppingCart,
+                '/api/recipes/shopping_cart/'
+            ),
+        )
+        steps = (
+            ('add', 'post', 'created', 'exists', 1),
+            ('remove', 'delete', 'deleted', 'missing', 0),
+        )
+        for name, model, url in bulk:
+            for step, method, success, repeated, expected in steps:
+                with self.subTest(f'{name}-{step}'):
+                    statuses, results = self.send_concurrently(
+                        method, url, {'ids': [self.recipe.id]}
+                    )
+                    self.assertEqual(statuses, Counter({200: THREADS_COUNT}))
+                    self.assertEqual(
+                        results,
+                        Counter({success: 1, repeated: THREADS_COUNT - 1})
+                    )
+                    self.assert_state(model, expected)
+
+    def test_clear(self):
+        """Очистка списка покупок: отметка удаляется один раз."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for number in range(ROUNDS_COUNT):
+            with self.subTest(f'shopping-cart-clear #{number + 1}'):
+                client.post(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+                statuses, _ = self.send_concurrently(
+                    'delete', '/api/recipes/shopping_cart/clear/'
+                )
+                self.assertEqual(statuses, Counter({204: THREADS_COUNT}))
+                self.assert_state(ShoppingCart, 0)
+
+
+def create_catalog_data():
+    """Пользователь, авторы, теги, ингредиенты и рецепты с отметками."""
+    user = create_user('user')
+    authors = [create_user(f'author{index}') for index in range(8)]
+    Tag.objects.bulk_create(
+        Tag(name=f'tag{index}', color='#000000', slug=f'tag{index}')
+        for index in range(3)
+    )
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'ingredient{index}', measurement_unit='г')
+        for index in range(10)
+    )
+    tags = list(Tag.objects.all())
+    ingredients = list(Ingredient.objects.all())
+    for number in range(3):
+        for index, author in enumerate(authors):
+            recipe = create_recipe(
+                author,
+                f'recipe{index}-{number}',
+                ingredients[index:index + 3]
+            )
+            recipe.tags.set(tags[:index % len(tags) + 1])
+            if index % 2:
+                Favorite.objects.create(user=user, recipe=recipe)
+            else:
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+    Follow.objects.bulk_create(
+        Follow(user=user, following=author) for author in authors[::2]
+    )
+    for author in authors[::2]:
+        feed.backfill_follow(user.id, author.id)
+    return user
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryCountTests(APITestCase):
+    """Число SQL-запросов к основным эндпоинтам API.
+
+    Перед каждым запросом кэш очищается, поэтому данные рецептов
+    загружаются из БД. Справочники загружаются один раз на процесс и
+    заранее.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_catalog_data()
+        cls.recipe = Recipe.objects.latest('id')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def clear_cache(self):
+        cache.clear()
+        reference.tags.get_state()
+        reference.ingredients.get_state()
+
+    def test_read_endpoints(self):
+        endpoints = (
+            ('recipe-list', True, '/api/recipes/', 5),
+            ('recipe-list-anonymous', False, '/api/recipes/', 4),
+            (
+                'recipe-list-filtered',
+                True,
+                '/api/recipes/?is_favorited=1&tags=tag0',
+                6
+            ),
+            ('recipe-detail', True, f'/api/recipes/{self.recipe.id}/', 4),
+            ('recipe-feed', True, '/api/recipes/feed/', 6),
+            ('user-list', True, '/api/users/', 3),
+            (
+                'subscriptions',
+                True,
+                '/api/users/subscriptions/?recipes_limit=2',
+                3
+            ),
+        )
+        anonymous = APIClient()
+        for label, authenticated, url, queries in endpoints:
+            client = self.client if authenticated else anonymous
+            self.clear_cache()
+            with self.subTest(label), self.assertNumQueries(queries):
+                response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_toggles(self):
+        recipe_url = f'/api/recipes/{self.recipe.id}'
+        author_url = f'/api/users/{self.recipe.author_id}'
+        toggles = (
+            (
+                'shopping-cart-add',
+                'post',
+                f'{recipe_url}/shopping_cart/',
+                201,
+                4
+            ),
+            (
+                'shopping-cart-remove',
+                'delete',
+                f'{recipe_url}/shopping_cart/',
+                204,
+                4
+            ),
+            ('favorite-remove', 'delete', f'{recipe_url}/favorite/', 204, 2),
+            ('favorite-add', 'post', f'{recipe_url}/favorite/', 201, 3),
+            ('subscribe-add', 'post', f'{author_url}/subscribe/', 201, 4),
+            (
+                'subscribe-remove',
+                'delete',
+                f'{author_url}/subscribe/',
+                204,
+                2
+            ),
+        )
+        self.clear_cache()
+        for label, method, url, expected_status, queries in toggles:
+            with self.subTest(label), self.assertNumQueries(
+                queries + SAVEPOINT_QUERIES
+            ):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, expected_status)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CacheInvalidationTests(APITestCase):
+    """Сброс кэша данных рецептов и условные GET-запросы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='tag', color='#000000', slug='tag')
+        cls.recipe = create_recipe(cls.author)
+        cls.recipe.tags.set([cls.tag])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get_recipe(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_cached_payload(self):
+        self.get_recipe()
+        with self.assertNumQueries(2):
+            self.get_recipe()
+
+    def test_recipe_change(self):
+        self.get_recipe()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'changed'
+            self.recipe.save()
+        self.assertEqual(self.get_recipe().data['name'], 'changed')
+
+    def test_tag_change(self):
+        self.get_recipe()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'changed'
+            self.tag.save()
+        self.assertEqual(self.get_recipe().data['tags'][0]['name'], 'changed')
+
+    def test_user_marks(self):
+        self.assertFalse(self.get_recipe().data['is_favorited'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{self.url}favorite/')
+        self.assertTrue(self.get_recipe().data['is_favorited'])
+
+    def test_not_modified(self):
+        etag = self.get_recipe()['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified_per_user(self):
+        etag = self.client.get('/api/recipes/')['ETag']
+        other = APIClient()
+        other.force_authenticate(self.author)
+        response = other.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CursorPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.recipe_ids = [
+            create_recipe(author, f'recipe{index}').id for index in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages(self):
+        url, recipe_ids = '/api/recipes/?cursor=&limit=2', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertLessEqual(len(response.data['results']), 2)
+            recipe_ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(recipe_ids, sorted(self.recipe_ids, reverse=True))
+
+    def test_page_number_mode(self):
+        response = self.client.get('/api/recipes/?limit=2')
+        self.assertEqual(response.data['count'], 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchFallbackTests(TestCase):
+    """Поиск рецептов по обратному индексу в памяти процесса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.soup = create_recipe(author, 'soup')
+        cls.soup.text = 'Томатный суп с базиликом'
+        cls.soup.save()
+        cls.salad = create_recipe(author, 'salad')
+        cls.salad.name = 'Салат с томатами'
+        cls.salad.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, value):
+        return list(search_fallback(Recipe.objects.all(), value))
+
+    def test_name_ranked_above_text(self):
+        self.assertEqual(self.search('томат'), [self.salad, self.soup])
+
+    def test_all_words(self):
+        self.assertEqual(self.search('том баз'), [self.soup])
+
+    def test_no_match(self):
+        self.assertEqual(self.search('борщ'), [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkMarksTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        author = create_user('author')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient{index}', measurement_unit='г')
+            for index in range(3)
+        )
+        cls.recipes = [
+            create_recipe(author, f'recipe{index}', Ingredient.objects.all())
+            for index in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def send(self, method, url, ids):
+        response = getattr(self.client, method)(
+            url, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (result['id'], result['status'])
+            for result in response.data['results']
+        ]
+
+    def test_favorites(self):
+        url = '/api/recipes/favorite/'
+        first, second = (recipe.id for recipe in self.recipes)
+        missing = second + 1
+        self.send('post', url, [first])
+        self.assertEqual(
+            self.send('post', url, [first, second, second, missing]),
+            [
+                (first, 'exists'),
+                (second, 'created'),
+                (missing, 'not_found')
+            ]
+        )
+        self.assertEqual(
+            self.send('delete', url, [first, missing]),
+            [(first, 'deleted'), (missing, 'missing')]
+        )
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )),
+            [0, 1]
+        )
+
+    def test_shopping_cart(self):
+        url = '/api/recipes/shopping_cart/'
+        recipe_ids = [recipe.id for recipe in self.recipes]
+        self.send('post', url, recipe_ids)
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )),
+            set(calculate_shopping_lists([self.user.id]))
+        )
+        self.send('delete', url, recipe_ids)
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_empty_ids(self):
+        response = self.client.post(
+            '/api/recipes/favorite/', {'ids': []}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+def encode_image(image_format='PNG', size=(4, 4)):
+    buffer = BytesIO()
+    Image.new('RGB', size).save(buffer, image_format)
+    return b64encode(buffer.getvalue()).decode('ascii')
+
+
+class Base64ImageFileFieldTests(TestCase):
+
+    def assert_error(self, data, code):
+        with self.assertRaises(ValidationError) as context:
+            Base64ImageFileField().to_internal_value(data)
+        self.assertEqual(context.exception.detail[0].code, code)
+
+    def test_valid_image(self):
+        upload = Base64ImageFileField().to_internal_value(
+            f'data:image/png;base64,{encode_image()}'
+        )
+        self.assertTrue(upload.name.endswith('.png'))
+        self.assertEqual(upload.content_type, 'image/png')
+        upload.close()
+
+    def test_invalid_base64(self):
+        self.assert_error('не base64', 'invalid_base64')
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=10)
+    def test_too_large(self):
+        self.assert_error(encode_image(), 'too_large')
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=10)
+    def test_too_many_pixels(self):
+        self.assert_error(encode_image(), 'too_many_pixels')
+
+    def test_invalid_format(self):
+        self.assert_error(encode_image('BMP'), 'invalid_format')
+
+    def test_not_an_image(self):
+        self.assert_error(b64encode(b'text').decode('ascii'), 'invalid_image')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CatalogLoaderTests(TestCase):
+    """Загрузка справочников с обновлением по естественному ключу."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write(self, name, content):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        return path
+
+    def test_csv(self):
+        path = self.write('tags.csv', 'Завтрак,#E26C2D,breakfast\n')
+        self.assertEqual(
+            catalog.load_catalog(catalog.TAGS, path),
+            catalog.LoadResult(1, 0, 0)
+        )
+        path = self.write(
+            'tags.csv',
+            'Завтрак,#000000,breakfast\nОбед,#49B64E,lunch\n\n'
+        )
+        self.assertEqual(
+            catalog.load_catalog(catalog.TAGS, path, batch_size=1),
+            catalog.LoadResult(1, 1, 0)
+        )
+        self.assertEqual(
+            Tag.objects.get(slug='breakfast').color, '#000000'
+        )
+
+    def test_json(self):
+        items = [
+            {'name': f'ингредиент {index}', 'measurement_unit': 'г'}
+            for index in range(20)
+        ]
+        path = self.write('ingredients.json', json.dumps(items))
+        with mock.patch.object(catalog, 'READ_CHUNK_SIZE', 16):
+            result = catalog.load_catalog(catalog.INGREDIENTS, path)
+        self.assertEqual(result, catalog.LoadResult(20, 0, 0))
+        self.assertEqual(
+            catalog.load_catalog(catalog.INGREDIENTS, path),
+            catalog.LoadResult(0, 0, 20)
+        )
+
+    def test_invalid_rows(self):
+        for name, content in (
+            ('tags.csv', 'Завтрак,breakfast\n'),
+            ('tags.json', '[{"name": "Завтрак", "slug": "breakfast"}]'),
+            ('tags.json', '{"name": "Завтрак"}'),
+        ):
+            with self.subTest(content), self.assertRaises(ValueError):
+                catalog.load_catalog(catalog.TAGS, self.write(name, content))
+
+    def test_command(self):
+        ingredients = self.write('ingredients.csv', 'соль,г\nсахар,г\n')
+        tags = self.write('tags.csv', 'Ужин,#8775D2,dinner\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'load_data_from_csv',
+                ingredients=str(ingredients),
+                tags=str(tags),
+                stdout=BytesIO()
+            )
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertEqual(Tag.objects.get().slug, 'dinner')
+        self.assertCountEqual(
+            [item['name'] for item in self.client.get(
+                '/api/ingredients/'
+            ).json()],
+            ['сахар', 'соль']
+        )
@@ -1,11 +1,12 @@
-from datetime import date
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Value
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
@@ -13,53 +14,158 @@ from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from users.models import Follow
 
-from .filters import IngredientFilter, RecipesFilter
-from .pagination import PageNumberLimitPagination
+from . import reference, shopping_list
+from .autocomplete import search_ingredients
+from .cache import (INGREDIENTS_VERSION, POPULARITY_VERSION,
+                    RECIPE_LIST_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                    bump_versions, count_version_name, get_versions,
+                    recipe_version_name, user_version_name)
+from .counters import change_counters
+from .feed import FeedPagination
+from .filters import RecipesFilter
+from .marks import delete_marks, insert_marks
+from .mixins import ConditionalGetMixin, ReferenceTableMixin
+from .pagination import CachedCountPagination, PageNumberOrCursorPagination
 from .permissions import IsUserOrReadOnly
-from .renderers import PassthroughRenderer
+from .popularity import get_popular_recipe_ids
+from .renderers import (CSVRenderer, JSONPassthroughRenderer, PDFRenderer,
+                        PlainTextRenderer)
 from .serializers import (FollowSerializer, IngredientSerializer,
-                          RecipeReducedSerializer, RecipeSerializer,
-                          RecipeWriteSerializer, TagSerializer)
+                          RecipeIdsSerializer, RecipeReducedSerializer,
+                          RecipeSerializer, RecipeWriteSerializer,
+                          ShoppingListItemSerializer, TagSerializer)
 
 User = get_user_model()
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, ReferenceTableMixin,
+                        ReadOnlyModelViewSet):
     """Получение ингридиентов."""
 
     pagination_class = None
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
-    filterset_class = IngredientFilter
-    filter_backends = (DjangoFilterBackend,)
-    filterset_fields = ['name']
+    etag_versions = (INGREDIENTS_VERSION,)
+    reference_table = reference.ingredients
+
+    def filter_queryset(self, queryset):
+        """Поиск по названию выполняется по индексу в памяти.
+
+        Пустое название не фильтрует список.
+        """
+        name = self.request.query_params.get('name', '').strip()
+        if not name:
+            return queryset
+        return search_ingredients(name, settings.INGREDIENT_SEARCH_LIMIT)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, ReferenceTableMixin,
+                 ReadOnlyModelViewSet):
     """Получение тегов."""
     pagination_class = None
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
+    etag_versions = (TAGS_VERSION,)
+    reference_table = reference.tags
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, ModelViewSet):
     """Получение рецептов."""
 
-    queryset = Recipe.objects.all()
     permission_classes = [IsUserOrReadOnly]
-    pagination_class = PageNumberLimitPagination
+    pagination_class = PageNumberOrCursorPagination
     filterset_class = RecipesFilter
     filter_backends = (DjangoFilterBackend,)
     filterset_fields = [
         'tags',
         'author',
         'is_favorited',
-        'is_in_shopping_cart'
+        'is_in_shopping_cart',
+        'search',
+        'ordering'
     ]
+    etag_per_user = True
+
+    def get_etag_versions(self):
+        """Версии списка или отдельного рецепта и общих данных."""
+        if self.action == 'retrieve':
+            self.etag_versions = (
+                RECIPES_VERSION,
+                recipe_version_name(self.kwargs[self.lookup_field])
+            )
+        elif self.request.query_params.get('ordering') == 'popular':
+            self.etag_versions = (
+                RECIPES_VERSION, RECIPE_LIST_VERSION, POPULARITY_VERSION
+            )
+        else:
+            self.etag_versions = (RECIPES_VERSION, RECIPE_LIST_VERSION)
+        return super().get_etag_versions()
+
+    def initial(self, request, *args, **kwargs):
+        """Версии данных рецептов до запросов к БД.
+
+        Для list и retrieve их читает ConditionalGetMixin вместе с ETag,
+        здесь — для popular и feed, отдающих RecipeSerializer с контекстом
+        представления.
+        """
+        super().initial(request, *args, **kwargs)
+        if self.action in ('popular', 'feed'):
+            names = (RECIPES_VERSION, RECIPE_LIST_VERSION)
+            self.version_snapshot = dict(zip(names, get_versions(*names)))
+
+    def get_count_version_names(self):
+        """Версии количества рецептов в списке.
+
+        Количество с фильтрами по избранному и списку покупок зависит
+        только от отметок текущего пользователя, поэтому отметки других
+        пользователей его не сбрасывают.
+        """
+        params = self.request.query_params
+        if self.request.user.is_authenticated and (
+            params.get('is_favorited') or params.get('is_in_shopping_cart')
+        ):
+            return (
+                count_version_name(Recipe),
+                user_version_name(self.request.user.id)
+            )
+        return (count_version_name(Recipe),)
+
+    def get_queryset(self):
+        """Рецепты с автором и отметками текущего пользователя.
+
+        Теги и ингредиенты загружает RecipeSerializer только для
+        рецептов, которых нет в кэше.
+        """
+        queryset = Recipe.objects.select_related('author')
+        user = self.request.user
+        if user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Exists(
+                    Favorite.objects.filter(
+                        user=user, recipe=OuterRef('pk')
+                    )
+                ),
+                is_in_shopping_cart=Exists(
+                    ShoppingCart.objects.filter(
+                        user=user, recipe=OuterRef('pk')
+                    )
+                )
+            )
+        return queryset.annotate(
+            is_favorited=Value(False, output_field=BooleanField()),
+            is_in_shopping_cart=Value(False, output_field=BooleanField())
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        shopping_list.change_recipe(
+            instance.id, shopping_list.get_recipe_amounts(instance.id), {}
+        )
+        instance.delete()
+
     def get_serializer_class(self):
         if self.action in ['favorite', 'shopping_cart']:
             return RecipeReducedSerializer
@@ -67,97 +173,222 @@ class RecipeViewSet(ModelViewSet):
             return RecipeWriteSerializer
         return RecipeSerializer
 
+    def toggle_recipe_mark(self, request, pk, model,
+                           on_add=None, on_remove=None):
+        """Добавить или удалить отметку рецепта пользователем.
+
+        Добавление выполняется одним INSERT в точке сохранения, повторная
+        отметка определяется по нарушению уникальности. Удаление
+        выполняется одним DELETE через delete_marks, рецепт запрашивается
+        только если удалять было нечего.
+        """
+        user = request.user
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                deleted = delete_marks(model, user.id, 'recipe', [pk])
+                if deleted and on_remove is not None:
+                    on_remove(user.id, pk)
+            if deleted:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(Recipe, id=pk)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        recipe = get_object_or_404(Recipe, id=pk)
+        try:
+            with transaction.atomic():
+                model.objects.create(user=user, recipe=recipe)
+                if on_add is not None:
+                    on_add(user.id, recipe.id)
+        except IntegrityError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        serializers_obj = self.get_serializer(recipe)
+        return Response(
+            serializers_obj.data,
+            status=status.HTTP_201_CREATED
+        )
+
     @action(methods=['post', 'delete'], detail=True)
     def favorite(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
-        user = request.user
-        if (self.request.method == 'DELETE'
-                and user.favorite_recipes.filter(recipe=recipe)):
-            user.favorite_recipes.get(recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        if (self.request.method == 'POST'
-                and not user.favorite_recipes.filter(recipe=recipe)):
-            Favorite.objects.create(user=user, recipe=recipe)
-            serializers_obj = self.get_serializer(
-                recipe
-            )
-            return Response(
-                serializers_obj.data,
-                status=status.HTTP_201_CREATED
-            )
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.toggle_recipe_mark(request, pk, Favorite)
 
     @action(methods=['post', 'delete'], detail=True)
     def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
+        return self.toggle_recipe_mark(
+            request,
+            pk,
+            ShoppingCart,
+            on_add=shopping_list.add_recipe,
+            on_remove=shopping_list.remove_recipe
+        )
+
+    def bulk_recipe_marks(self, request, model):
+        """Массово добавить или удалить отметки рецептов.
+
+        Добавление выполняется одним INSERT ... ON CONFLICT DO NOTHING,
+        удаление одним DELETE; оба возвращают id действительно
+        измененных строк, поэтому строки, одновременно добавленные или
+        удаленные другим запросом, не учитываются в счетчиках. Для
+        каждого переданного id возвращается статус: created, exists
+        или not_found при добавлении, deleted или missing при удалении.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
         user = request.user
-        if (self.request.method == 'DELETE'
-                and user.shopping_carts.filter(recipe=recipe)):
-            user.shopping_carts.get(recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        if (self.request.method == 'POST'
-                and not user.shopping_carts.filter(recipe=recipe)):
-            ShoppingCart.objects.create(user=user, recipe=recipe)
-            serializers_obj = self.get_serializer(
-                recipe
-            )
-            return Response(
-                serializers_obj.data,
-                status=status.HTTP_201_CREATED
-            )
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        # Рецепты проверяются до транзакции: в SQLite транзакция, которая
+        # начинается с чтения, при одновременной записи завершается
+        # ошибкой блокировки вместо ожидания
+        existing = set()
+        if request.method != 'DELETE':
+            existing = set(Recipe.objects.filter(
+                id__in=ids
+            ).values_list('id', flat=True))
+        with transaction.atomic():
+            if request.method == 'DELETE':
+                changed = delete_marks(model, user.id, 'recipe', ids)
+                statuses = {
+                    recipe_id: 'deleted' if recipe_id in changed else 'missing'
+                    for recipe_id in ids
+                }
+            else:
+                changed = set()
+                if existing:
+                    changed = insert_marks(model, user.id, 'recipe', existing)
+                if changed:
+                    # Вставка без ORM не отправляет сигналы post_save
+                    change_counters(
+                        model,
+                        [
+                            model(user_id=user.id, recipe_id=recipe_id)
+                            for recipe_id in changed
+                        ],
+                        1
+                    )
+                    bump_versions(user_version_name(user.id))
+                statuses = {
+                    recipe_id: (
+                        'created' if recipe_id in changed
+                        else 'exists' if recipe_id in existing
+                        else 'not_found'
+                    )
+                    for recipe_id in ids
+                }
+            if changed and model is ShoppingCart:
+                shopping_list.rebuild_shopping_list(user.id)
+        return Response({
+            'results': [
+                {'id': recipe_id, 'status': statuses[recipe_id]}
+                for recipe_id in ids
+            ]
+        })
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='favorite',
+        url_name='favorite-bulk',
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_bulk(self, request):
+        """Добавить или удалить из избранного рецепты из списка ids."""
+        return self.bulk_recipe_marks(request, Favorite)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_bulk(self, request):
+        """Добавить или удалить из списка покупок рецепты из списка ids."""
+        return self.bulk_recipe_marks(request, ShoppingCart)
+
+    @action(
+        methods=['delete'],
+        detail=False,
+        url_path='shopping_cart/clear',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_clear(self, request):
+        """Очистить список покупок.
+
+        Рецепты корзины читаются до транзакции, удаляются через
+        delete_marks, и список покупок пересчитывается по тому, что
+        осталось в корзине после одновременных запросов.
+        """
+        user = request.user
+        recipe_ids = list(ShoppingCart.objects.filter(
+            user=user
+        ).values_list('recipe_id', flat=True))
+        if recipe_ids:
+            with transaction.atomic():
+                if delete_marks(ShoppingCart, user.id, 'recipe', recipe_ids):
+                    shopping_list.rebuild_shopping_list(user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False)
+    def popular(self, request):
+        """Самые популярные рецепты по рейтингу из кэша."""
+        recipe_ids = get_popular_recipe_ids()
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = self.get_serializer(
+            [
+                recipes[recipe_id] for recipe_id in recipe_ids
+                if recipe_id in recipes
+            ],
+            many=True
+        )
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination
+    )
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь."""
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(
         methods=['get'],
         detail=False,
-        renderer_classes=(PassthroughRenderer,),
+        renderer_classes=(
+            PlainTextRenderer,
+            CSVRenderer,
+            JSONPassthroughRenderer,
+            PDFRenderer
+        ),
         permission_classes=[IsAuthenticated]
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        final_list = {}
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__in_shopping_cart__user=user).values_list(
-            'ingredient__name', 'ingredient__measurement_unit',
-            'amount'
+        """Список покупок в формате ?format=txt|csv|json|pdf."""
+        return shopping_list.shopping_list_response(
+            request.user, request.accepted_renderer.format
         )
-        for item in ingredients:
-            name = item[0]
-            if name not in final_list:
-                final_list[name] = {
-                    'measurement_unit': item[1],
-                    'amount': item[2]
-                }
-            else:
-                final_list[name]['amount'] += item[2]
-        response_list = []
-        lenght_empty_str = 30
-        response_list.append(
-            f'Список покупок пользователя: {user.first_name} {user.last_name}'
+
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='shopping_cart/summary',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_summary(self, request):
+        """Суммарные количества ингредиентов списка покупок."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by(
+            'ingredient__name', 'ingredient__measurement_unit'
         )
-        response_list.append(f'Дата: {date.today()}')
-        response_list.append('-' * lenght_empty_str)
-        counter_shop = 1
-        for element in sorted(final_list.keys()):
-            amount = final_list[element]['amount']
-            measurement_unit = final_list[element]['measurement_unit']
-            shop = f'{counter_shop}. {element} - {amount} {measurement_unit}'
-            response_list.append(shop)
-            counter_shop += 1
-        response_list.append('-' * lenght_empty_str)
-        response_list.append('Foodgram. Продуктовый помощник')
-        response = HttpResponse(
-            '\n'.join(response_list),
-            content_type='text/plain'
+        return Response(
+            ShoppingListItemSerializer(items, many=True).data
         )
-        response['Content-Disposition'] = ('attachment; '
-                                           'filename="shopping_list.txt"')
-        return response
 
 
 class CustomUserViewSet(UserViewSet):
     """Получение и работа с пользователями."""
-    pagination_class = PageNumberLimitPagination
+    pagination_class = CachedCountPagination
 
     def get_permissions(self):
         if self.request.user.is_anonymous and (
@@ -168,26 +399,29 @@ class CustomUserViewSet(UserViewSet):
 
     @action(methods=['post', 'delete'], detail=True)
     def subscribe(self, request, id=None):
-        following = get_object_or_404(User, id=id)
         user = request.user
-        if (self.request.method == 'DELETE'
-                and user.subscriptions.filter(following=following)):
-            Follow.objects.filter(
-                user=user, following=following
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        if (self.request.method == 'POST'
-                and user != following
-                and not user.subscriptions.filter(following=following)):
-            Follow.objects.create(user=user, following=following)
-            serializer_class_obj = self.get_serializer(
-                user.subscriptions.get(user=user, following=following)
-            )
-            return Response(
-                serializer_class_obj.data,
-                status=status.HTTP_201_CREATED
-            )
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        if self.request.method == 'DELETE':
+            with transaction.atomic():
+                deleted = delete_marks(Follow, user.id, 'following', [id])
+            if deleted:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(User, id=id)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        following = get_object_or_404(User, id=id)
+        if user == following:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                follow = Follow.objects.create(
+                    user=user, following=following
+                )
+        except IntegrityError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        serializer_class_obj = self.get_serializer(follow)
+        return Response(
+            serializer_class_obj.data,
+            status=status.HTTP_201_CREATED
+        )
 
     def get_response_data(self, paginated_queryset):
         return self.get_serializer(
@@ -196,9 +430,11 @@ class CustomUserViewSet(UserViewSet):
 
     @action(detail=False)
     def subscriptions(self, request):
-        queryset = request.user.subscriptions
-        page = self.paginate_queryset(queryset.all())
-        if page:
+        queryset = request.user.subscriptions.select_related(
+            'following'
+        ).order_by('id')
+        page = self.paginate_queryset(queryset)
+        if page is not None:
             data = self.get_response_data(page)
             return self.get_paginated_response(data)
         data = self.get_response_data(queryset)
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -76,6 +77,33 @@ DATABASES = {
     }
 }
 
+# Тестовая БД SQLite создается файлом, а не в памяти: соединения потоков
+# к БД в памяти блокируют таблицы без ожидания, и проверки одновременных
+# запросов завершаются ошибками
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+
+# Кэш версий, данных рецептов и количеств должен быть общим для всех
+# процессов: в развертывании задается memcached через CACHE_BACKEND и
+# CACHE_LOCATION. LocMemCache у каждого процесса свой и подходит только
+# для разработки
+CACHES = {
+    'default': {
+        'BACKEND': getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+# Предел числа ключей локального, файлового и табличного кэша: при
+# значении по умолчанию (300) вытесняются ключи версий. Memcached
+# не принимает этот параметр
+if 'memcached' not in CACHES['default']['BACKEND']:
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(getenv('CACHE_MAX_ENTRIES', default=100_000)),
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -122,12 +150,85 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,
 }
 
+# Время хранения количества записей для постраничных списков (в секундах)
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    getenv('PAGINATION_COUNT_CACHE_TIMEOUT', default=60)
+)
+
+# Для PostgreSQL: если оценка планировщика (reltuples) для таблицы без
+# фильтров больше порога, она возвращается вместо COUNT(*).
+# Пустое значение отключает оценку.
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = (
+    int(getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD'))
+    if getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD') else None
+)
+
+# Время хранения данных рецептов в кэше (в секундах)
+RECIPE_CACHE_TIMEOUT = int(
+    getenv('RECIPE_CACHE_TIMEOUT', default=60 * 60 * 24)
+)
+
+# Максимальное число ингредиентов в ответе поиска по названию
+INGREDIENT_SEARCH_LIMIT = int(getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+
+# Шрифт с кириллицей для списка покупок в PDF
+SHOPPING_LIST_PDF_FONT = getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Авторы, у которых подписчиков больше порога, не рассылают рецепты
+# в ленты: их рецепты добавляются в ленту при чтении
+FEED_FANOUT_THRESHOLD = int(getenv('FEED_FANOUT_THRESHOLD', default=1000))
+
+# Количество лент, заполняемых одним запросом при публикации рецепта
+FEED_FANOUT_BATCH_SIZE = int(getenv('FEED_FANOUT_BATCH_SIZE', default=500))
+
+# Количество последних рецептов автора, добавляемых в ленту при подписке
+FEED_BACKFILL_LIMIT = int(getenv('FEED_BACKFILL_LIMIT', default=100))
+
+# Период полураспада популярности рецепта (в часах)
+POPULARITY_HALF_LIFE_HOURS = float(
+    getenv('POPULARITY_HALF_LIFE_HOURS', default=72)
+)
+
+# Задержка учета новых добавлений при пересчете популярности
+# (в секундах), чтобы успели зафиксироваться параллельные транзакции
+POPULARITY_REFRESH_LAG = int(getenv('POPULARITY_REFRESH_LAG', default=60))
+
+# Размер списка популярных рецептов
+POPULAR_RECIPES_LIMIT = int(getenv('POPULAR_RECIPES_LIMIT', default=20))
+
+# Количество процессов для создания уменьшенных копий изображений.
+# 0 - обработка сразу после сохранения рецепта в текущем процессе
+IMAGE_WORKERS = int(getenv('IMAGE_WORKERS', default=2))
+# Наибольшее число изображений в очереди на обработку, остальные
+# обрабатываются командой build_image_variants
+IMAGE_QUEUE_LIMIT = int(getenv('IMAGE_QUEUE_LIMIT', default=100))
+
+# Ограничения на изображение рецепта: размер файла (в байтах)
+# и количество пикселей
+RECIPE_IMAGE_MAX_SIZE = int(
+    getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    getenv('RECIPE_IMAGE_MAX_PIXELS', default=40_000_000)
+)
+
+# Замер времени SQL, представления, сериализации и рендеринга: заголовок
+# Server-Timing и журнал запросов дольше REQUEST_PROFILING_SLOW_MS (мс)
+REQUEST_PROFILING = getenv('REQUEST_PROFILING', default='False') == 'True'
+REQUEST_PROFILING_SLOW_MS = float(
+    getenv('REQUEST_PROFILING_SLOW_MS', default=500)
+)
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 DJOSER = {
     'HIDE_USERS': False,
     'SERIALIZERS': {
         'user': 'api.serializers.CustomUserSerializer',
+        'current_user': 'api.serializers.CustomUserSerializer',
     },
     'PERMISSIONS':
     {
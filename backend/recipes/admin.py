@@ -1,8 +1,12 @@
+from api.cache import invalidate_recipes
+from api.mixins import MarksAdminMixin
+from api.shopping_list import rebuild_shopping_list
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
-from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
+from .models import (Favorite, FeedItem, Ingredient, IngredientRecipe,
+                     PopularityRefresh, Recipe, RecipePopularity, ShoppingCart,
+                     ShoppingListItem, Tag)
 
 User = get_user_model()
 
@@ -28,6 +32,15 @@ class IngredientRecipeAdmin(admin.ModelAdmin):
     )
     search_fields = ('recipe', 'ingredient')
 
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_recipes(obj.recipe_id)
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        invalidate_recipes(*recipe_ids)
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -55,7 +68,9 @@ class RecipeAdmin(admin.ModelAdmin):
         # 'ingredients',
         # 'tags',
         'cooking_time',
-        'pub_date'
+        'pub_date',
+        'favorites_count',
+        'shopping_carts_count'
     )
     search_fields = ('name', 'author', 'tags')
     list_filter = ('name', 'tags', 'author')
@@ -63,7 +78,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(MarksAdminMixin, admin.ModelAdmin):
     """Админка избранного."""
     list_display = (
         'user',
@@ -72,9 +87,51 @@ class FavoriteAdmin(admin.ModelAdmin):
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(MarksAdminMixin, admin.ModelAdmin):
     """Админка списка покупок."""
     list_display = (
         'user',
         'recipe',
     )
+
+    def marks_deleted(self, user_id):
+        rebuild_shopping_list(user_id)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    """Админка суммарных списков покупок."""
+    list_display = (
+        'user',
+        'ingredient',
+        'total_amount',
+    )
+
+
+@admin.register(FeedItem)
+class FeedItemAdmin(admin.ModelAdmin):
+    """Админка лент подписок."""
+    list_display = (
+        'user',
+        'recipe',
+        'pub_date',
+    )
+
+
+@admin.register(RecipePopularity)
+class RecipePopularityAdmin(admin.ModelAdmin):
+    """Админка рейтинга популярности."""
+    list_display = (
+        'recipe',
+        'score',
+    )
+
+
+@admin.register(PopularityRefresh)
+class PopularityRefreshAdmin(admin.ModelAdmin):
+    """Админка пересчетов популярности."""
+    list_display = (
+        'refreshed_at',
+        'favorite_watermark',
+        'shopping_cart_watermark',
+    )
@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import django
+from api.images import build_variants, save_variants
+from django.conf import settings
+from django.core.management import BaseCommand
+from recipes.models import Recipe
+
+# Количество рецептов, читаемых одним запросом
+BATCH_SIZE: int = 200
+
+
+class Command(BaseCommand):
+    help = 'Создание уменьшенных копий изображений существующих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать варианты и для уже обработанных рецептов'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=max(settings.IMAGE_WORKERS, 1),
+            help='Количество процессов'
+        )
+
+    def get_pending(self, rebuild):
+        """Пары (id, имя файла) рецептов без актуальных вариантов."""
+        recipes = Recipe.objects.exclude(image='').order_by('id').values_list(
+            'id', 'image', 'image_variants'
+        )
+        last_id = 0
+        while True:
+            batch = list(recipes.filter(id__gt=last_id)[:BATCH_SIZE])
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            for recipe_id, image_name, variants in batch:
+                if rebuild or (variants or {}).get('source') != image_name:
+                    yield recipe_id, image_name
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=get_context('spawn'),
+            initializer=django.setup
+        ) as pool:
+            futures = {
+                pool.submit(build_variants, image_name): recipe_id
+                for recipe_id, image_name in self.get_pending(options['all'])
+            }
+            for future in as_completed(futures):
+                recipe_id = futures[future]
+                try:
+                    save_variants(recipe_id, future.result())
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'Рецепт {recipe_id}: {error}')
+                    continue
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}, ошибок: {failed}'
+        ))
@@ -0,0 +1,26 @@
+from api.archive import CHUNK_SIZE, export_recipes
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгрузка рецептов с авторами, тегами, ингредиентами '
+        'и изображениями в каталог архива'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог архива')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Количество рецептов, читаемых одним запросом'
+        )
+
+    def handle(self, *args, **options):
+        recipes, images = export_recipes(
+            options['path'], options['chunk_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {recipes}, изображений: {images}'
+        ))
@@ -0,0 +1,266 @@
+import random
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from api import feed
+from api.archive import create_recipes
+from api.cache import RECIPE_LIST_VERSION, bump_versions, count_version_name
+from api.catalog import INGREDIENTS, TAGS, invalidate_catalog, load_catalog
+from api.counters import change_counters
+from api.images import build_variants
+from api.popularity import refresh_popularity
+from api.shopping_list import calculate_shopping_lists
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+# Количество объектов, записываемых в одной транзакции
+BATCH_SIZE: int = 1000
+# За сколько дней распределяются даты публикации рецептов
+PUBLICATION_DAYS: int = 365
+# Число тегов и ингредиентов в рецепте
+TAGS_PER_RECIPE = (1, 3)
+INGREDIENTS_PER_RECIPE = (3, 10)
+# Количество ингредиента и время приготовления в рецепте
+AMOUNT_RANGE = (1, 500)
+COOKING_TIME_RANGE = (5, 180)
+# Виды блюд для названий рецептов
+DISHES = ('Салат', 'Суп', 'Пирог', 'Запеканка', 'Паста', 'Омлет', 'Рагу')
+# Имя общего изображения сгенерированных рецептов
+IMAGE_NAME = 'synthetic.png'
+
+
+def batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация тестовых пользователей, рецептов, избранного, списков '
+        'покупок и подписок с неравномерным распределением по авторам '
+        'и рецептам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument(
+            '--favorites',
+            type=int,
+            default=20,
+            help='Среднее число рецептов в избранном пользователя'
+        )
+        parser.add_argument(
+            '--carts',
+            type=int,
+            default=5,
+            help='Среднее число рецептов в списке покупок пользователя'
+        )
+        parser.add_argument(
+            '--follows',
+            type=int,
+            default=10,
+            help='Среднее число подписок пользователя'
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=1.1,
+            help=(
+                'Показатель закона Ципфа для распределения рецептов '
+                'по авторам, избранного и подписок'
+            )
+        )
+        parser.add_argument('--prefix', default='synthetic')
+        parser.add_argument('--password', default='synthetic-password')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def get_weights(self, count, skew):
+        """Накопленные веса по закону Ципфа для random.choices."""
+        return list(accumulate(
+            1 / rank ** skew for rank in range(1, count + 1)
+        ))
+
+    def pick(self, population, cum_weights, average):
+        """Случайный набор без повторов, в среднем average элементов."""
+        count = self.random.randint(0, 2 * average)
+        return set(self.random.choices(
+            population, cum_weights=cum_weights, k=count
+        ))
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        start = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(options['password'])
+        usernames = [
+            f'{prefix}{number}'
+            for number in range(start, start + options['users'])
+        ]
+        for batch in batches(usernames):
+            User.objects.bulk_create(
+                User(
+                    email=f'{username}@example.com',
+                    username=username,
+                    first_name=username,
+                    last_name=username,
+                    password=password
+                )
+                for username in batch
+            )
+        user_ids = []
+        for batch in batches(usernames):
+            user_ids += User.objects.filter(
+                username__in=batch
+            ).values_list('id', flat=True)
+        return user_ids
+
+    def get_image(self):
+        """Общее изображение рецептов и его варианты, создаются один раз.
+
+        Варианты берутся из уже сгенерированного рецепта или строятся
+        сразу: без них данные рецептов не кэшируются.
+        """
+        field = Recipe._meta.get_field('image')
+        name = field.generate_filename(None, IMAGE_NAME)
+        if not field.storage.exists(name):
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480), (222, 184, 135)).save(buffer, 'PNG')
+            name = field.storage.save(name, ContentFile(buffer.getvalue()))
+        for variants in Recipe.objects.filter(image=name).values_list(
+            'image_variants', flat=True
+        )[:1]:
+            if (variants or {}).get('source') == name:
+                return name, variants
+        return name, build_variants(name)
+
+    def create_recipes(self, options, author_ids):
+        authors = self.random.sample(author_ids, len(author_ids))
+        author_weights = self.get_weights(len(authors), options['skew'])
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        ingredients = list(Ingredient.objects.values_list('id', 'name'))
+        image_name, image_variants = self.get_image()
+        images = {IMAGE_NAME: image_name}
+        now = timezone.now()
+        recipe_ids = []
+        for batch in batches(range(options['recipes'])):
+            rows = []
+            for _ in batch:
+                recipe_ingredients = self.random.sample(
+                    ingredients,
+                    self.random.randint(*INGREDIENTS_PER_RECIPE)
+                )
+                rows.append({
+                    'author_id': self.random.choices(
+                        authors, cum_weights=author_weights
+                    )[0],
+                    'name': (
+                        f'{self.random.choice(DISHES)}: '
+                        f'{recipe_ingredients[0][1]}'
+                    )[:200],
+                    'text': ', '.join(
+                        name for _, name in recipe_ingredients
+                    )[:256],
+                    'cooking_time': self.random.randint(*COOKING_TIME_RANGE),
+                    'pub_date': now - timedelta(
+                        seconds=self.random.randint(
+                            0, PUBLICATION_DAYS * 24 * 3600
+                        )
+                    ),
+                    'image': IMAGE_NAME,
+                    'tags': self.random.sample(
+                        tag_ids,
+                        min(self.random.randint(*TAGS_PER_RECIPE),
+                            len(tag_ids))
+                    ),
+                    'ingredients': [
+                        (ingredient_id, self.random.randint(*AMOUNT_RANGE))
+                        for ingredient_id, _ in recipe_ingredients
+                    ],
+                })
+            with transaction.atomic():
+                recipes = create_recipes(rows, images)
+                Recipe.objects.filter(
+                    id__in=[recipe.id for recipe in recipes]
+                ).update(image_variants=image_variants)
+                change_counters(Recipe, recipes, 1)
+            recipe_ids += [recipe.id for recipe in recipes]
+        return recipe_ids
+
+    def create_marks(self, model, field, user_ids, targets, average, skew):
+        """Отметки пользователей с популярностью целей по закону Ципфа."""
+        targets = self.random.sample(targets, len(targets))
+        weights = self.get_weights(len(targets), skew)
+        marks = [
+            model(user_id=user_id, **{f'{field}_id': target_id})
+            for user_id in user_ids
+            for target_id in self.pick(targets, weights, average)
+            if target_id != user_id or model is not Follow
+        ]
+        for batch in batches(marks):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+                change_counters(model, batch, 1)
+        return marks
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        for catalog, path in (
+            (INGREDIENTS, './data/ingredients.csv'),
+            (TAGS, './data/tags.csv'),
+        ):
+            invalidate_catalog(catalog, load_catalog(catalog, path))
+        user_ids = self.create_users(options)
+        self.stdout.write(f'Пользователей: {len(user_ids)}')
+        recipe_ids = self.create_recipes(options, user_ids)
+        self.stdout.write(f'Рецептов: {len(recipe_ids)}')
+        favorites = self.create_marks(
+            Favorite, 'recipe', user_ids, recipe_ids,
+            options['favorites'], options['skew']
+        )
+        self.stdout.write(f'В избранном: {len(favorites)}')
+        carts = self.create_marks(
+            ShoppingCart, 'recipe', user_ids, recipe_ids,
+            options['carts'], options['skew']
+        )
+        for batch in batches(user_ids):
+            with transaction.atomic():
+                ShoppingListItem.objects.bulk_create(
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total_amount
+                    )
+                    for user_id, ingredient_id, total_amount
+                    in calculate_shopping_lists(batch)
+                )
+        self.stdout.write(f'В списках покупок: {len(carts)}')
+        follows = self.create_marks(
+            Follow, 'following', user_ids, user_ids,
+            options['follows'], options['skew']
+        )
+        for batch in batches(follows):
+            with transaction.atomic():
+                for follow in batch:
+                    feed.backfill_follow(follow.user_id, follow.following_id)
+        self.stdout.write(f'Подписок: {len(follows)}')
+        # Отметки созданы только что, без задержки POPULARITY_REFRESH_LAG
+        # они не попали бы в рейтинг
+        refresh_popularity(lag=0)
+        bump_versions(
+            RECIPE_LIST_VERSION,
+            count_version_name(Recipe),
+            count_version_name(User),
+            count_version_name(Follow)
+        )
+        self.stdout.write(self.style.SUCCESS('Данные созданы'))
@@ -0,0 +1,51 @@
+from api.archive import CHUNK_SIZE, import_recipes
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import DatabaseError
+
+
+class Command(BaseCommand):
+    help = (
+        'Загрузка рецептов из каталога архива. Уже загруженные рецепты '
+        'пропускаются, поэтому прерванную загрузку можно повторить'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Каталог архива')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Количество процессов, 0 - загрузка в текущем процессе'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Количество рецептов в одной транзакции'
+        )
+        parser.add_argument(
+            '--skip-variants',
+            action='store_true',
+            help='Не создавать уменьшенные копии изображений'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            stats = import_recipes(
+                options['path'], options['workers'], options['chunk_size']
+            )
+        except (OSError, ValueError, KeyError, DatabaseError) as error:
+            raise CommandError(
+                f'Загрузка прервана: {error!r}. Повторный запуск '
+                'продолжит ее с незагруженных рецептов.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено рецептов: {stats["recipes"]}, '
+            f'пропущено загруженных ранее: {stats["skipped"]}, '
+            f'авторов: {stats["authors"]}, тегов: {stats["tags"]}, '
+            f'ингредиентов: {stats["ingredients"]}'
+        ))
+        if stats['recipes'] and not options['skip_variants']:
+            call_command(
+                'build_image_variants', workers=max(options['workers'], 1)
+            )
@@ -1,9 +1,10 @@
 import logging
 import sys
-from csv import DictReader
 
-from django.core.management import BaseCommand
-from recipes.models import Ingredient, Tag
+from api.catalog import (BATCH_SIZE, INGREDIENTS, TAGS, invalidate_catalog,
+                         load_catalog)
+from django.core.management import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -16,46 +17,54 @@ handler.setFormatter(formatter)
 
 
 class Command(BaseCommand):
-    help = 'Загрузка данных в БД'
+    help = (
+        'Загрузка ингредиентов и тегов из CSV или JSON с обновлением '
+        'по естественному ключу, без удаления существующих записей'
+    )
 
-    def handle(self, *args, **options):
-        logger.info('Удаление данных в таблице Ингридиенты')
-        Ingredient.objects.all().delete()
-
-        logger.info('Загрузка ингридиентов в БД')
-        ingredients = []
-        for row in DictReader(
-            open('./data/ingredients.csv', encoding='utf-8'),
-            ['name', 'measurement_unit']
-        ):
-            ingredients.append(
-                Ingredient(
-                    name=row['name'],
-                    measurement_unit=row['measurement_unit'],
-                )
-            )
-
-        Ingredient.objects.bulk_create(ingredients)
-
-        logger.info('Загрузка ингридиентов в БД завершена')
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            default='./data/ingredients.csv',
+            help='Файл ингредиентов: CSV (name, measurement_unit) или JSON'
+        )
+        parser.add_argument(
+            '--tags',
+            default='./data/tags.csv',
+            help='Файл тегов: CSV (name, color, slug) или JSON'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Число записей, записываемых за один раз'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Посчитать изменения и откатить их'
+        )
 
-        logger.info('Удаление данных в таблице Теги')
-        Tag.objects.all().delete()
-
-        logger.info('Загрузка тегов в БД')
-        tags = []
-        for row in DictReader(
-            open('./data/tags.csv', encoding='utf-8'),
-            ['name', 'color', 'slug']
-        ):
-            tags.append(
-                Tag(
-                    name=row['name'],
-                    color=row['color'],
-                    slug=row['slug'],
-                )
-            )
-
-        Tag.objects.bulk_create(tags)
-
-        logger.info('Загрузка тегов в БД завершена')
+    def handle(self, *args, **options):
+        catalogs = (
+            ('Ингридиенты', INGREDIENTS, options['ingredients']),
+            ('Теги', TAGS, options['tags']),
+        )
+        try:
+            with transaction.atomic():
+                for title, catalog, path in catalogs:
+                    logger.info(f'Загрузка {path}')
+                    result = load_catalog(
+                        catalog, path, options['batch_size']
+                    )
+                    logger.info(
+                        f'{title}: добавлено {result.inserted}, '
+                        f'обновлено {result.updated}, '
+                        f'без изменений {result.unchanged}'
+                    )
+                    invalidate_catalog(catalog, result)
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+                    logger.info('Пробный запуск, изменения отменены')
+        except (OSError, ValueError, DatabaseError) as error:
+            raise CommandError(f'Загрузка не выполнена: {error}')
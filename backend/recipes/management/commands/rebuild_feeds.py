@@ -0,0 +1,28 @@
+from api.feed import backfill_follow
+from django.core.management import BaseCommand
+from users.models import Follow
+
+# Количество подписок, читаемых одним запросом
+BATCH_SIZE: int = 1000
+
+
+class Command(BaseCommand):
+    help = 'Заполнение лент подписок по существующим подпискам'
+
+    def handle(self, *args, **options):
+        follows = Follow.objects.order_by('id').values_list(
+            'id', 'user_id', 'following_id'
+        )
+        last_id = 0
+        processed = 0
+        while True:
+            batch = list(follows.filter(id__gt=last_id)[:BATCH_SIZE])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            for _, user_id, author_id in batch:
+                backfill_follow(user_id, author_id)
+            processed += len(batch)
+        self.stdout.write(
+            self.style.SUCCESS(f'Обработано подписок: {processed}')
+        )
@@ -0,0 +1,94 @@
+from api.shopping_list import calculate_shopping_lists
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import ShoppingListItem
+
+# Размер пакета при вставке строк
+BATCH_SIZE: int = 1000
+
+
+class Command(BaseCommand):
+    help = 'Пересчет или проверка суммарных списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить таблицу с рецептами в списках покупок'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='users',
+            help='Id пользователя, можно указать несколько раз'
+        )
+
+    def get_expected(self, users):
+        return {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount
+            in calculate_shopping_lists(users).iterator()
+        }
+
+    def get_actual(self, users):
+        items = ShoppingListItem.objects.all()
+        if users is not None:
+            items = items.filter(user__in=users)
+        return {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in items.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            ).iterator()
+        }
+
+    def verify(self, users):
+        expected = self.get_expected(users)
+        actual = self.get_actual(users)
+        differences = [
+            (key, expected.get(key), actual.get(key))
+            for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        ]
+        for (user_id, ingredient_id), needed, stored in sorted(
+            differences, key=lambda difference: difference[0]
+        ):
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'ожидается {needed}, в таблице {stored}'
+            )
+        if differences:
+            raise CommandError(f'Расхождений: {len(differences)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+
+    @transaction.atomic
+    def rebuild(self, users):
+        items = ShoppingListItem.objects.all()
+        if users is not None:
+            items = items.filter(user__in=users)
+        items.delete()
+        batch = []
+        created = 0
+        for user_id, ingredient_id, total_amount in calculate_shopping_lists(
+            users
+        ).iterator():
+            batch.append(ShoppingListItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount
+            ))
+            if len(batch) >= BATCH_SIZE:
+                ShoppingListItem.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        ShoppingListItem.objects.bulk_create(batch)
+        created += len(batch)
+        self.stdout.write(
+            self.style.SUCCESS(f'Записано строк: {created}')
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify(options['users'])
+        else:
+            self.rebuild(options['users'])
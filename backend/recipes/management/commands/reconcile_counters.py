@@ -0,0 +1,61 @@
+from api.counters import COUNTERS, count_related
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+# Количество объектов, проверяемых в одной транзакции
+BATCH_SIZE: int = 1000
+
+
+class Command(BaseCommand):
+    help = 'Проверка и исправление денормализованных счетчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только вывести количество расхождений'
+        )
+
+    def reconcile(self, source, field, model, counter, verify):
+        """Сверить счетчик пакетами по id, вернуть число расхождений."""
+        actual = count_related(source, field)
+        drifted_total = 0
+        last_id = 0
+        while True:
+            ids = list(
+                model.objects.filter(pk__gt=last_id).order_by(
+                    'pk'
+                ).values_list('pk', flat=True)[:BATCH_SIZE]
+            )
+            if not ids:
+                return drifted_total
+            last_id = ids[-1]
+            with transaction.atomic():
+                drifted = list(
+                    model.objects.filter(pk__in=ids).annotate(
+                        actual=actual
+                    ).exclude(
+                        **{counter: F('actual')}
+                    ).values_list('pk', flat=True)
+                )
+                if drifted and not verify:
+                    model.objects.filter(pk__in=drifted).update(
+                        **{counter: actual}
+                    )
+            drifted_total += len(drifted)
+
+    def handle(self, *args, **options):
+        total = 0
+        for source, field, model, counter in COUNTERS:
+            drifted = self.reconcile(
+                source, field, model, counter, options['verify']
+            )
+            total += drifted
+            action = 'найдено' if options['verify'] else 'исправлено'
+            self.stdout.write(
+                f'{model._meta.object_name}.{counter}: '
+                f'{action} расхождений {drifted}'
+            )
+        if options['verify'] and total:
+            raise CommandError(f'Расхождений: {total}')
@@ -0,0 +1,25 @@
+from api.popularity import refresh_popularity
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.models import PopularityRefresh, RecipePopularity
+
+
+class Command(BaseCommand):
+    help = 'Пересчет рейтинга популярности рецептов по новым добавлениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Удалить рейтинг и посчитать его заново по всем записям'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['rebuild']:
+                RecipePopularity.objects.all().delete()
+                PopularityRefresh.objects.all().delete()
+            updated = refresh_popularity()
+        self.stdout.write(
+            self.style.SUCCESS(f'Обновлено рецептов: {updated}')
+        )
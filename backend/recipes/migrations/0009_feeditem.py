@@ -0,0 +1,69 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feeds(apps, schema_editor):
+    """Заполнить ленты существующих подписок.
+
+    Как и backfill_follow: последние FEED_BACKFILL_LIMIT рецептов автора,
+    если у него не больше FEED_FANOUT_THRESHOLD подписчиков. Ленты
+    заполняются одним INSERT ... SELECT с нумерацией рецептов автора.
+    """
+    feed_item = apps.get_model('recipes', 'FeedItem')._meta.db_table
+    recipe = apps.get_model('recipes', 'Recipe')._meta.db_table
+    follow = apps.get_model('users', 'Follow')._meta.db_table
+    schema_editor.execute(
+        f'''
+        INSERT INTO {feed_item} (user_id, recipe_id, pub_date)
+        SELECT follow.user_id, recipe.id, recipe.pub_date
+        FROM {follow} AS follow
+        INNER JOIN (
+            SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+                PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+            ) AS position
+            FROM {recipe}
+        ) AS recipe ON recipe.author_id = follow.following_id
+        WHERE recipe.position <= %s AND follow.following_id IN (
+            SELECT following_id FROM {follow}
+            GROUP BY following_id HAVING COUNT(*) <= %s
+        )
+        ''',
+        params=[settings.FEED_BACKFILL_LIMIT, settings.FEED_FANOUT_THRESHOLD]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0008_recipe_counters'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Рецепт ленты подписок',
+                'verbose_name_plural': 'Ленты подписок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feed_item_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_items'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import OuterRef, Subquery
+
+
+def fill_created(apps, schema_editor):
+    """Датировать существующие отметки публикацией рецепта.
+
+    Иначе все отметки, добавленные до миграции, получают текущее время и
+    считаются свежими в рейтинге популярности.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    pub_date = Subquery(
+        Recipe.objects.filter(pk=OuterRef('recipe_id')).values('pub_date')
+    )
+    for model_name in ('Favorite', 'ShoppingCart'):
+        apps.get_model('recipes', model_name).objects.update(
+            created=pub_date
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_feeditem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Время пересчета')),
+                ('favorite_watermark', models.BigIntegerField(verbose_name='Последний учтенный id избранного')),
+                ('shopping_cart_watermark', models.BigIntegerField(verbose_name='Последний учтенный id списка покупок')),
+            ],
+            options={
+                'verbose_name': 'Пересчет популярности',
+                'verbose_name_plural': 'Пересчеты популярности',
+                'ordering': ('-id',),
+                'get_latest_by': 'id',
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(db_index=True, help_text='Взвешенное число добавлений на момент пересчета', verbose_name='Популярность')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+                'ordering': ('-score',),
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_created, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Файлы уменьшенных копий изображения по размерам и форматам', verbose_name='Варианты изображения'),
+        ),
+    ]
@@ -143,15 +143,54 @@ class Recipe(models.Model):
         help_text='Дата и время публикации',
         db_index=True
     )
+    favorites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+        help_text='Сколько раз рецепт добавлен в избранное'
+    )
+    shopping_carts_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+        help_text='Сколько раз рецепт добавлен в список покупок'
+    )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Варианты изображения',
+        help_text='Файлы уменьшенных копий изображения по размерам и форматам'
+    )
+    # Поля, которые меняются только запросами update()
+    computed_fields = (
+        'favorites_count', 'shopping_carts_count', 'image_variants'
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.author}'
 
+    def save(self, *args, **kwargs):
+        """Не перезаписывать счетчики при сохранении рецепта."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.computed_fields
+            ]
+        super().save(*args, **kwargs)
+
 
 class Favorite(models.Model):
     """Модель избранного."""
@@ -169,6 +208,10 @@ class Favorite(models.Model):
         verbose_name='Рецепт',
         help_text='Рецепт в избранном'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -197,6 +240,10 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт',
         help_text='Рецепт в списке покупок'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -207,3 +254,133 @@ class ShoppingCart(models.Model):
                 fields=['user', 'recipe'],
             )
         ]
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается при изменении списка покупок и ингредиентов рецептов,
+    пересчитывается командой rebuild_shopping_lists.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        'Ingredient',
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингридиент'
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Количество',
+        help_text='Суммарное количество по всем рецептам списка покупок'
+    )
+
+    class Meta:
+        verbose_name = 'Ингридиент списка покупок'
+        verbose_name_plural = 'Ингридиенты списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                name='unique_shopping_list_items',
+                fields=['user', 'ingredient'],
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.ingredient}, {self.total_amount}'
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя.
+
+    Заполняется при публикации рецепта для подписчиков автора и при
+    подписке, дата публикации копируется для выборки страниц ленты
+    по индексу.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Рецепт ленты подписок'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                name='unique_feed_items',
+                fields=['user', 'recipe'],
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_item_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.recipe}'
+
+
+class RecipePopularity(models.Model):
+    """Популярность рецепта по недавним добавлениям в избранное и
+    в списки покупок с затуханием по времени.
+
+    Пересчитывается командой refresh_popularity.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(
+        db_index=True,
+        verbose_name='Популярность',
+        help_text='Взвешенное число добавлений на момент пересчета'
+    )
+
+    class Meta:
+        ordering = ('-score',)
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+
+    def __str__(self):
+        return f'{self.recipe}, {self.score:.2f}'
+
+
+class PopularityRefresh(models.Model):
+    """Пересчет популярности рецептов.
+
+    Единственная запись хранит время последнего пересчета и id последних
+    учтенных записей избранного и списков покупок.
+    """
+    refreshed_at = models.DateTimeField(verbose_name='Время пересчета')
+    favorite_watermark = models.BigIntegerField(
+        verbose_name='Последний учтенный id избранного'
+    )
+    shopping_cart_watermark = models.BigIntegerField(
+        verbose_name='Последний учтенный id списка покупок'
+    )
+
+    class Meta:
+        ordering = ('-id',)
+        get_latest_by = 'id'
+        verbose_name = 'Пересчет популярности'
+        verbose_name_plural = 'Пересчеты популярности'
+
+    def __str__(self):
+        return f'{self.refreshed_at}'
@@ -1,3 +1,4 @@
+from api.mixins import MarksAdminMixin
 from django.contrib import admin
 
 from .models import CustomUser, Follow
@@ -11,16 +12,19 @@ class CustomUserAdmin(admin.ModelAdmin):
         'username',
         'first_name',
         'last_name',
-        'password'
+        'password',
+        'recipes_count',
+        'followers_count'
     )
     search_fields = ('username',)
     list_filter = ('username', 'email')
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(MarksAdminMixin, admin.ModelAdmin):
     """Админка подписок."""
     list_display = (
         'user',
         'following',
     )
+    mark_field = 'following'
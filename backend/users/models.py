@@ -7,8 +7,24 @@ class CustomUser(AbstractUser):
     first_name = models.CharField('first name', max_length=150, unique=True)
     last_name = models.CharField('last name', max_length=150, unique=True)
     email = models.EmailField('email address', unique=True)
+    followers_count = models.IntegerField(
+        'подписчиков', default=0, editable=False
+    )
+    recipes_count = models.IntegerField('рецептов', default=0, editable=False)
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    # Поля, которые меняются только запросами update()
+    computed_fields = ('followers_count', 'recipes_count')
+
+    def save(self, *args, **kwargs):
+        """Не перезаписывать счетчики при сохранении пользователя."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.computed_fields
+            ]
+        super().save(*args, **kwargs)
 
 
 class Follow(models.Model):